@@ -0,0 +1,86 @@
+"""Measure how long importing cso_utils and each client takes.
+
+Every import is timed in a fresh interpreter. The third-party packages
+that each import pulls in are listed so that an eager import of a heavy
+dependency shows up as a regression.
+
+Usage:
+    python -m benchmarks.import_time --output import_time.json
+    python -m benchmarks.import_time --compare import_time.json --max-ratio 1.5
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+TARGETS = ('cso_utils',
+           'from cso_utils import zendesk',
+           'from cso_utils import ssactivewear',
+           'from cso_utils import channeladvisor',
+           'from cso_utils import github_api',
+           'from cso_utils import database')
+
+HEAVY_PACKAGES = ('bs4', 'github', 'pymysql', 'numpy')
+
+SCRIPT = '''
+import sys, time
+start = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - start
+heavy = sorted(name for name in {heavy!r} if name in sys.modules)
+print(elapsed, ','.join(heavy))
+'''
+
+
+def time_import(statement: str, repeat: int) -> dict:
+    """Return the median seconds taken by the import statement and the
+    heavy packages it loaded.
+    """
+    seconds = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', SCRIPT.format(statement=statement, heavy=HEAVY_PACKAGES)],
+                                check=True, capture_output=True, text=True).stdout.split()
+        seconds.append(float(output[0]))
+        heavy = output[1].split(',') if len(output) > 1 else []
+    return {'median_seconds': statistics.median(seconds), 'seconds': seconds, 'heavy_packages': heavy}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--repeat', type=int, default=7)
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--compare', help='compare with the results in this JSON file')
+    parser.add_argument('--max-ratio', type=float, default=None,
+                        help='exit with an error if any import is this many times slower than in --compare')
+    args = parser.parse_args()
+
+    results = dict()
+    for target in TARGETS:
+        statement = target if target.startswith('from') else f'import {target}'
+        results[target] = time_import(statement, args.repeat)
+        print(f"{target:40} {results[target]['median_seconds'] * 1000:8.1f} ms   "
+              f"{', '.join(results[target]['heavy_packages'])}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        failed = False
+        print()
+        for target, result in results.items():
+            if target not in baseline:
+                continue
+            ratio = result['median_seconds'] / baseline[target]['median_seconds']
+            print(f'{target:40} x{ratio:5.2f}')
+            if args.max_ratio is not None and ratio > args.max_ratio:
+                failed = True
+        if failed:
+            sys.exit(f'Import time regressed by more than x{args.max_ratio}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+"""Profile the accessors of the StoredData classes.
+
+Builds synthetic payloads of a configurable size for every StoredData
+subclass and reports, for each accessor, the time per call (ns/op, with
+the garbage collector disabled as in timeit) and the peak memory
+allocated during one call (bytes/op, measured with tracemalloc). Results
+can be written as JSON and compared with an earlier run to catch
+regressions. --cprofile prints where the time of each accessor goes.
+
+Usage:
+    python -m benchmarks.profile_accessors --packages 100 --output accessors.json
+    python -m benchmarks.profile_accessors --compare accessors.json --max-ratio 1.2
+    python -m benchmarks.profile_accessors --only Tracking --cprofile
+"""
+import argparse
+import cProfile
+import datetime
+import gc
+import json
+import platform
+import pstats
+import statistics
+import sys
+import time
+import tracemalloc
+
+from cso_utils import __version__, channeladvisor, pricing, reconciliation, ssactivewear, zendesk
+from benchmarks import stub_server
+
+
+def payloads(args: argparse.Namespace) -> {str: object}:
+    """Return a StoredData object of the configured size for every subclass."""
+    created_at = datetime.datetime(2021, 6, 28, 7)
+    ticket = stub_server.make_ticket(1, created_at)
+    ticket['custom_fields'] = [{'id': field, 'value': f'value {field}'} for field in range(args.custom_fields)]
+    ticket['requester_id'] = args.packages - 1  # the last side-loaded user
+    ca_order = stub_server.make_ca_order(1, '2021-06-28')
+    ca_order['Items'] = [dict(ca_order['Items'][0], Sku=f'B{line:08d}', Quantity=line + 1)
+                         for line in range(args.items)]
+    lines = args.packages * args.lines
+    return {'Order': ssactivewear.Order(stub_server.make_order('100000', args.packages, args.lines)),
+            'Tracking': ssactivewear.Tracking([stub_server.make_tracking(f'1Z{i:08d}')
+                                               for i in range(args.packages)]),
+            'ReturnRequest': ssactivewear.ReturnRequest([{'returnInformation': {'raNumber': 'RA1',
+                                                                                'returnToAddress': {'city': 'Reno'}}}]),
+            'Product': ssactivewear.Product(stub_server.make_product(1)),
+            'Style': ssactivewear.Style(stub_server.make_style(1)),
+            'Ticket': zendesk.Ticket(ticket),
+            'TicketBundle': zendesk.TicketBundle({'tickets': [ticket],
+                                                  'users': [{'id': i} for i in range(args.packages)],
+                                                  'groups': [{'id': ticket['group_id']}]}),
+            'ChannelAdvisorOrder': channeladvisor.ChannelAdvisorOrder(ca_order),
+            'Discrepancy': reconciliation.Discrepancy({'kind': reconciliation.QTY_MISMATCH, 'po_number': '1',
+                                                       'sku': 'B0', 'ca_qty': 2, 'ss_qty_ordered': 1}),
+            'Quote': pricing.PriceMatrix(['B0'], [2.0], [1.5], [0], [72]).quote(['B0'] * lines, range(lines),
+                                                                               [i // 10 for i in range(lines)])}
+
+
+def accessors(objects: {str: object}) -> {str: 'callable'}:
+    """Return {Class.accessor: function calling it once}."""
+    order = objects['Order']
+    tracking = objects['Tracking']
+    product = objects['Product']
+    style = objects['Style']
+    ticket = objects['Ticket']
+    bundle = objects['TicketBundle']
+    ca_order = objects['ChannelAdvisorOrder']
+    discrepancy = objects['Discrepancy']
+    quote = objects['Quote']
+    return {'Order.po_number': order.po_number,
+            'Order.lines': order.lines,
+            'Order.tracking_nums': order.tracking_nums,
+            'Order.invoices': order.invoices,
+            'Tracking.num_and_status': tracking.num_and_status,
+            'ReturnRequest.instructions': objects['ReturnRequest'].instructions,
+            'Product.sku': product.sku,
+            'Product.piece_price': product.piece_price,
+            'Style.title': style.title,
+            'Style.description': style.description,
+            'Ticket.custom_fields': ticket.custom_fields,
+            'Ticket.creation_datetime': ticket.creation_datetime,
+            'Ticket.has_text': lambda: ticket.has_text('not there'),
+            'Ticket.sent_from': lambda: ticket.sent_from('customer1@example.com'),
+            'TicketBundle.requester': lambda: bundle.requester(ticket),
+            'ChannelAdvisorOrder.lines': ca_order.lines,
+            'ChannelAdvisorOrder.creation_datetime': ca_order.creation_datetime,
+            'ChannelAdvisorOrder.po_number': ca_order.po_number,
+            'Discrepancy.kind': discrepancy.kind,
+            'Quote.unit_prices': quote.unit_prices,
+            'Quote.order_totals': quote.order_totals}
+
+
+def ns_per_op(func: 'callable', repeat: int, min_ns: int) -> [float]:
+    """Return the ns per call of each of repeat runs, each run calling func
+    enough times to take at least min_ns.
+    """
+    number = 1
+    while True:
+        elapsed = _run(func, number)
+        if elapsed >= min_ns:
+            break
+        number *= 10 if elapsed < min_ns / 10 else 2
+    runs = [elapsed / number]
+    for _ in range(repeat - 1):
+        runs.append(_run(func, number) / number)
+    return runs
+
+
+def _run(func: 'callable', number: int) -> int:
+    """Return the ns taken by calling func number times without garbage collection."""
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        start = time.perf_counter_ns()
+        for _ in range(number):
+            func()
+        return time.perf_counter_ns() - start
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+
+def bytes_per_op(func: 'callable', warmup: int = 100) -> int:
+    """Return the peak memory allocated while calling func once, including its result.
+    Every result is kept alive until the end: the warmup calls use up the
+    free lists (of dicts, lists, ...) that earlier runs filled, and no call
+    can reuse the objects freed by the one before it and hide its own
+    allocations from tracemalloc.
+    """
+    results = [func() for _ in range(warmup)]
+    tracemalloc.start()
+    try:
+        peaks = []
+        for _ in range(3):
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            results.append(func())
+            peaks.append(tracemalloc.get_traced_memory()[1] - before)
+        return min(peaks)
+    finally:
+        tracemalloc.stop()
+        del results
+
+
+def profile(name: str, func: 'callable', limit: int) -> None:
+    """Print the functions that take the most time in func."""
+    profiler = cProfile.Profile()
+    profiler.enable()
+    for _ in range(1000):
+        func()
+    profiler.disable()
+    print(f'\n{name}')
+    pstats.Stats(profiler, stream=sys.stdout).sort_stats('tottime').print_stats(limit)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--packages', type=int, default=20, help='packages per Order and Tracking, users per TicketBundle')
+    parser.add_argument('--lines', type=int, default=10, help='lines per Order package')
+    parser.add_argument('--items', type=int, default=20, help='items per ChannelAdvisorOrder')
+    parser.add_argument('--custom-fields', type=int, default=50, help='custom fields per Ticket')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--min-time', type=float, default=0.05, help='seconds per run')
+    parser.add_argument('--only', nargs='*', help='profile accessors whose name contains any of these')
+    parser.add_argument('--cprofile', action='store_true', help='print the slowest functions of each accessor')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--compare', help='compare with the results in this JSON file')
+    parser.add_argument('--max-ratio', type=float, default=None,
+                        help='exit with an error if any accessor is this many times slower than in --compare')
+    args = parser.parse_args()
+
+    results = dict()
+    for name, func in accessors(payloads(args)).items():
+        if args.only and not any(part in name for part in args.only):
+            continue
+        runs = ns_per_op(func, args.repeat, int(args.min_time * 1e9))
+        results[name] = {'ns_per_op': min(runs), 'median_ns_per_op': statistics.median(runs),
+                         'bytes_per_op': bytes_per_op(func)}
+        print(f"{name:40} {results[name]['ns_per_op']:12.0f} ns/op {results[name]['bytes_per_op']:10d} B/op")
+        if args.cprofile:
+            profile(name, func, 10)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'cso_utils_version': __version__.__version__,
+                       'python': platform.python_version(),
+                       'config': {key: value for key, value in vars(args).items()
+                                  if key in ('packages', 'lines', 'items', 'custom_fields')},
+                       'results': results}, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(f"\nCompared to cso_utils {baseline['cso_utils_version']}:")
+        failed = False
+        for name, result in results.items():
+            old = baseline['results'].get(name)
+            if not old:
+                continue
+            time_ratio = result['ns_per_op'] / old['ns_per_op']
+            memory_ratio = result['bytes_per_op'] / max(1, old['bytes_per_op'])
+            print(f'{name:40} time x{time_ratio:5.2f}   memory x{memory_ratio:5.2f}')
+            if args.max_ratio is not None and time_ratio > args.max_ratio:
+                failed = True
+        if failed:
+            sys.exit(f'An accessor regressed by more than x{args.max_ratio}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+"""Benchmark the API clients against the local stub server.
+
+Measures wall time, throughput and peak Python memory (tracemalloc) of
+the main client calls and writes the results as JSON so that runs can
+be compared across versions.
+
+Usage:
+    python -m benchmarks.run_benchmarks --products 500000 --output results.json
+    python -m benchmarks.run_benchmarks --compare results.json
+"""
+import argparse
+import datetime
+import json
+import platform
+import os
+import statistics
+import tempfile
+import time
+import random
+import tracemalloc
+
+from cso_utils import __version__, catalog_snapshot, channeladvisor, columnar, pricing, reconciliation, ssactivewear, zendesk
+from benchmarks import stub_server
+
+
+def measure(func: 'callable', repeat: int) -> dict:
+    """Run func repeat times and once more under tracemalloc. func returns
+    the number of items it handled.
+    """
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        items = func()
+        seconds.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    median = statistics.median(seconds)
+    return {'items': items,
+            'seconds': seconds,
+            'median_seconds': median,
+            'min_seconds': min(seconds),
+            'items_per_second': items / median if median else None,
+            'peak_memory_bytes': peak}
+
+
+def cases(args: argparse.Namespace, stub: stub_server.StubAPI, ss_api: ssactivewear.SSActivewear,
+          zen_api: zendesk.Zendesk, ca_api: channeladvisor.ChannelAdvisor) -> {str: 'callable'}:
+    """Return {benchmark name: function returning the number of items handled}."""
+    cutoff = datetime.date.today() - datetime.timedelta(days=stub.ticket_days // 2)
+    po_numbers = [str(100000 + i) for i in range(50)]
+    invoices = [f'{po}00' for po in po_numbers]
+
+    def tickets():
+        return len(zen_api.tickets_created_between_today_and(cutoff.month, cutoff.day, cutoff.year))
+
+    quote = dict()
+
+    def price_quote():
+        if not quote:
+            matrix = pricing.PriceMatrix.from_products(ss_api.get_products())
+            rng = random.Random(0)
+            quote['matrix'] = matrix
+            quote['skus'] = [stub_server.make_product(rng.randrange(stub.products))['sku']
+                             for _ in range(args.quote_lines)]
+            quote['qtys'] = [rng.randrange(1, 200) for _ in range(args.quote_lines)]
+            quote['orders'] = [i // 20 for i in range(args.quote_lines)]
+        quote['matrix'].quote(quote['skus'], quote['qtys'], quote['orders'])
+        return args.quote_lines
+
+    snapshot = dict()
+
+    def snapshot_lookups():
+        if not snapshot:
+            snapshot['directory'] = tempfile.TemporaryDirectory()
+            path = os.path.join(snapshot['directory'].name, 'catalog.snap')
+            catalog_snapshot.export_catalog(ss_api, path)
+            snapshot['reader'] = catalog_snapshot.CatalogSnapshot(path)
+            rng = random.Random(0)
+            snapshot['skus'] = [stub_server.make_product(rng.randrange(stub.products))['sku']
+                                for _ in range(50000)]
+        reader = snapshot['reader']
+        for sku in snapshot['skus']:
+            reader.get_product(sku).piece_price()
+        return len(snapshot['skus'])
+
+    def export_csv():
+        orders = (ssactivewear.Order(stub_server.make_order(str(100000 + i))) for i in range(args.export_orders))
+        with tempfile.TemporaryDirectory() as directory:
+            return columnar.write_csv(os.path.join(directory, 'lines.csv'), columnar.SS_ORDER_LINES, orders)
+
+    def full_returns():
+        for po in po_numbers:
+            ss_api.full_return(po, 1, 'benchmark', True)
+        return len(po_numbers)
+
+    def partial_returns():
+        for po in po_numbers:
+            order = ss_api.get_order(po)
+            first = order.lines()[0]
+            ss_api.partial_return(po, {first['sku']: first['qty_shipped']}, 1, 'benchmark', True)
+        return len(po_numbers)
+
+    return {'ssactivewear.get_products': lambda: len(ss_api.get_products()),
+            'ssactivewear.get_products(fields)': lambda: len(ss_api.get_products(
+                fields=['piecePrice', 'casePrice', 'salePrice', 'caseQty'])),
+            'ssactivewear.get_styles': lambda: len(ss_api.get_styles()),
+            'ssactivewear.get_order': lambda: sum(len(ss_api.get_order(po).lines()) for po in po_numbers),
+            'ssactivewear.track_using_invoices': lambda: len(ss_api.track_using_invoices(invoices).num_and_status()),
+            'ssactivewear.full_return': full_returns,
+            'ssactivewear.partial_return': partial_returns,
+            'ssactivewear.batch_return': lambda: len(ss_api.batch_return({po: None for po in po_numbers},
+                                                                         1, 'benchmark', True,
+                                                                         requests_per_second=None)),
+            'channeladvisor.get_orders_shipped_on': lambda: sum(len(order.lines())
+                                                                for order in ca_api.get_orders_shipped_on(9, 1, 2021)),
+            'channeladvisor.get_orders_shipped_on(fields)': lambda: len(ca_api.get_orders_shipped_on(
+                9, 1, 2021, fields=['SiteOrderID'], expand=['Items'])),
+            'reconciliation.reconcile_shipped_on': lambda: sum(1 for _ in reconciliation.reconcile_shipped_on(
+                ca_api, ss_api, 9, 1, 2021)),
+            'zendesk.tickets_created_between_today_and': tickets,
+            'pricing.quote': price_quote,
+            'catalog_snapshot.get_product': snapshot_lookups,
+            'columnar.write_csv': export_csv}
+
+
+def run(args: argparse.Namespace) -> dict:
+    """Run the selected benchmarks and return the results."""
+    stub = stub_server.StubAPI(products=args.products, styles=args.styles, tickets=args.tickets,
+                               ticket_days=args.ticket_days, ca_orders=args.ca_orders,
+                               page_size=args.page_size, latency=args.latency / 1000)
+    results = dict()
+    with stub:
+        ss_api = ssactivewear.SSActivewear('test', 'test')
+        zen_api = zendesk.Zendesk('test', 'test@example.com', 'test')
+        ca_api = channeladvisor.ChannelAdvisor('test')
+        stub_server.point_clients_at(stub.url, ss_api, zen_api, ca_api)
+        for name, func in cases(args, stub, ss_api, zen_api, ca_api).items():
+            if args.only and not any(part in name for part in args.only):
+                continue
+            func()  # warm up the stub's payload cache
+            requests_before = stub.requests
+            results[name] = measure(func, args.repeat)
+            results[name]['requests_per_run'] = (stub.requests - requests_before) // (args.repeat + 1)
+            print(f"{name:50} {results[name]['median_seconds'] * 1000:10.1f} ms"
+                  f"{results[name]['peak_memory_bytes'] / 2 ** 20:10.1f} MiB")
+    return {'cso_utils_version': __version__.__version__,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'config': {key: value for key, value in vars(args).items()
+                       if key not in ('output', 'compare', 'only')},
+            'results': results}
+
+
+def compare(current: dict, baseline: dict) -> None:
+    """Print the change of each benchmark relative to the baseline."""
+    print(f"\nCompared to cso_utils {baseline['cso_utils_version']}:")
+    for name, result in current['results'].items():
+        old = baseline['results'].get(name)
+        if not old:
+            continue
+        time_ratio = result['median_seconds'] / old['median_seconds']
+        memory_ratio = result['peak_memory_bytes'] / max(1, old['peak_memory_bytes'])
+        print(f'{name:50} time x{time_ratio:5.2f}   memory x{memory_ratio:5.2f}')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--products', type=int, default=50000)
+    parser.add_argument('--styles', type=int, default=2500)
+    parser.add_argument('--tickets', type=int, default=5000)
+    parser.add_argument('--ticket-days', type=int, default=30)
+    parser.add_argument('--ca-orders', type=int, default=2000)
+    parser.add_argument('--quote-lines', type=int, default=1000000)
+    parser.add_argument('--export-orders', type=int, default=20000)
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0, help='milliseconds per request')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--only', nargs='*', help='run benchmarks whose name contains any of these')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--compare', help='compare with the results in this JSON file')
+    args = parser.parse_args()
+
+    results = run(args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
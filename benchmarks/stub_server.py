@@ -0,0 +1,312 @@
+"""Local stub of the S&S Activewear, Zendesk and ChannelAdvisor APIs.
+
+Serves synthetic but realistically shaped payloads so that the clients
+can be benchmarked without network access. Point a client at the stub
+with point_clients_at().
+
+Example:
+    with StubAPI(products=500000, latency=0.05) as stub:
+        ss_api = ssactivewear.SSActivewear('test', 'test')
+        point_clients_at(stub.url, ss_api)
+        ss_api.get_products()
+"""
+import datetime
+import http.server
+import json
+import threading
+import time
+import urllib.parse
+
+from cso_utils import channeladvisor, ssactivewear, zendesk
+
+
+def make_product(i: int) -> dict:
+    """Return a synthetic S&S Activewear product."""
+    return {'sku': f'B{i:08d}',
+            'gtin': f'{i:014d}',
+            'styleID': i // 20,
+            'brandName': f'Brand {i % 50}',
+            'styleName': f'{i // 20}',
+            'colorName': f'Color {i % 12}',
+            'sizeName': ('XS', 'S', 'M', 'L', 'XL', '2XL', '3XL')[i % 7],
+            'caseQty': 72,
+            'piecePrice': round(2 + (i % 500) / 100, 2),
+            'dozenPrice': round(1.9 + (i % 500) / 100, 2),
+            'casePrice': round(1.8 + (i % 500) / 100, 2),
+            'salePrice': round(1.5 + (i % 500) / 100, 2) if i % 10 == 0 else 0,
+            'qty': i % 1000,
+            'warehouses': [{'warehouseAbbr': 'NV', 'qty': i % 400},
+                           {'warehouseAbbr': 'TX', 'qty': i % 600}]}
+
+
+def make_style(i: int) -> dict:
+    """Return a synthetic S&S Activewear style."""
+    return {'styleID': i,
+            'partNumber': f'{i:05d}',
+            'brandName': f'Brand {i % 50}',
+            'styleName': f'{i}',
+            'title': f'Style {i} Tee',
+            'baseCategory': ('T-Shirts', 'Fleece', 'Polos', 'Headwear')[i % 4],
+            'description': '<ul><li>5.3 oz., 100% cotton</li><li>Tear away label</li>'
+                           '<li>Double-needle stitched</li></ul>'}
+
+
+def make_order(po_number: str, packages: int = 2, lines_per_package: int = 5) -> [dict]:
+    """Return a synthetic S&S Activewear order with the given PO number."""
+    order = []
+    for p in range(packages):
+        order.append({'poNumber': po_number,
+                      'invoiceNumber': f'{po_number}{p:02d}',
+                      'orderNumber': f'O{po_number}{p:02d}',
+                      'trackingNumber': f'1Z{po_number}{p:02d}',
+                      'guid': f'guid-{po_number}-{p}',
+                      'orderType': 'Order',
+                      'orderStatus': 'Shipped',
+                      'lines': [{'sku': f'B{(int(po_number) * 7 + line) % 100000:08d}',
+                                 'qtyOrdered': line + 1,
+                                 'qtyShipped': line + 1}
+                                for line in range(lines_per_package)]})
+    return order
+
+
+def make_tracking(number: str) -> dict:
+    """Return synthetic S&S Activewear tracking data for one package."""
+    return {'trackingNumber': number,
+            'carrierName': 'UPS',
+            'latestCheckpoint': {'checkpointDate': '6/28/2021',
+                                 'checkpointTime': '7:00 AM',
+                                 'checkpointStatusMessage': 'In Transit'}}
+
+
+def make_ticket(i: int, created_at: datetime.datetime) -> dict:
+    """Return a synthetic Zendesk ticket."""
+    return {'id': i,
+            'subject': f'Where is my order {i}?',
+            'description': 'Hello, I have not received my order yet.',
+            'status': ('new', 'open', 'pending', 'solved')[i % 4],
+            'group_id': i % 5,
+            'tags': ['order_status', f'tag{i % 10}'],
+            'created_at': created_at.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'updated_at': created_at.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'via': {'channel': 'email', 'source': {'from': {'address': f'customer{i}@example.com'}}},
+            'custom_fields': [{'id': field, 'value': f'value {i}'} for field in range(10)]}
+
+
+def make_ca_order(i: int, shipped_on: str) -> dict:
+    """Return a synthetic ChannelAdvisor order."""
+    return {'ID': i,
+            'SiteName': ('Amazon', 'eBay', 'Walmart')[i % 3],
+            'SiteOrderID': f'111-{i:07d}-0000000',
+            'CreatedDateUtc': f'{shipped_on}T01:02:03.45Z',
+            'ShippingDateUtc': f'{shipped_on}T10:00:00Z',
+            'ShippingStatus': 'Shipped',
+            'Items': [{'Sku': f'B{(i * 7 + line) % 100000:08d}',
+                       'Title': f'Item {line}',
+                       'Quantity': line + 1,
+                       'UnitPrice': 4.56,
+                       'UnitEstimatedShippingCost': 0.78}
+                      for line in range(1 + i % 4)],
+            'Fulfillments': [{'TrackingNumber': f'1Z{i:08d}', 'ShippingCarrier': 'UPS'}]}
+
+
+class StubAPI:
+    """Serve the stub APIs on a local port in a background thread.
+
+    Args:
+        products: Number of products in the S&S Activewear catalog.
+        styles: Number of styles in the S&S Activewear catalog.
+        tickets: Number of Zendesk tickets, newest first.
+        ticket_days: Number of days the tickets are spread over, ending today.
+        ca_orders: Number of ChannelAdvisor orders shipped on any given day.
+        page_size: Page size of the Zendesk and ChannelAdvisor listings.
+        latency: Seconds to wait before answering each request.
+    """
+    def __init__(self, products: int = 10000, styles: int = 500, tickets: int = 2000,
+                 ticket_days: int = 30, ca_orders: int = 1000, page_size: int = 100,
+                 latency: float = 0):
+        self.products = products
+        self.styles = styles
+        self.tickets = tickets
+        self.ticket_days = ticket_days
+        self.ca_orders = ca_orders
+        self.page_size = page_size
+        self.latency = latency
+        self.requests = 0
+        self._cache = dict()
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+        self.url = None
+
+    def __enter__(self) -> 'StubAPI':
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def start(self) -> str:
+        """Start serving and return the base URL."""
+        stub = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                stub._handle(self)
+
+            def do_POST(self):
+                stub._handle(self)
+
+            def do_PUT(self):
+                stub._handle(self)
+
+            def log_message(self, *args):
+                pass
+
+        class Server(http.server.ThreadingHTTPServer):
+            daemon_threads = True
+            # the default backlog of 5 drops connections from concurrent clients
+            request_queue_size = 128
+
+        self._server = Server(('127.0.0.1', 0), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        self.url = f'http://127.0.0.1:{self._server.server_address[1]}'
+        return self.url
+
+    def stop(self) -> None:
+        """Stop serving."""
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _cached(self, key: str, build: 'callable') -> bytes:
+        """Return the encoded payload for key, building it once."""
+        with self._lock:
+            if key not in self._cache:
+                self._cache[key] = json.dumps(build()).encode()
+            return self._cache[key]
+
+    def _handle(self, handler: http.server.BaseHTTPRequestHandler) -> None:
+        with self._lock:
+            self.requests += 1
+        length = int(handler.headers.get('Content-Length') or 0)
+        body = handler.rfile.read(length) if length else b''
+        if self.latency:
+            time.sleep(self.latency)
+        split = urllib.parse.urlsplit(handler.path)
+        path = urllib.parse.unquote(split.path)
+        query = urllib.parse.parse_qs(split.query)
+        status, payload = self._route(handler.command, path, query, body)
+        handler.send_response(status)
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Content-Length', str(len(payload)))
+        handler.end_headers()
+        handler.wfile.write(payload)
+
+    def _route(self, method: str, path: str, query: dict, body: bytes) -> (int, bytes):
+        parts = path.strip('/').split('/')
+        if parts[0] == 'v2':
+            return self._ssactivewear(method, parts[1:], query)
+        if parts[:3] == ['api', 'v2', 'tickets']:
+            return self._zendesk(method, parts[3:], query)
+        if parts[0] == 'v1' and parts[1].startswith('Orders'):
+            return self._channeladvisor(parts[1], query)
+        return 404, b'{"error": "not found"}'
+
+    def _ssactivewear(self, method: str, parts: [str], query: dict) -> (int, bytes):
+        resource = parts[0].lower()
+        argument = parts[1] if len(parts) > 1 else ''
+        fields = query.get('fields', [''])[0]
+        if resource == 'products' and not argument:
+            return 200, self._cached('products?' + fields, 
+                                     lambda: [_project(make_product(i), fields) for i in range(self.products)])
+        if resource == 'products':
+            return 200, json.dumps([make_product(int(argument.lstrip('B') or 0))]).encode()
+        if resource == 'styles' and not argument:
+            return 200, self._cached('styles?' + fields, 
+                                     lambda: [_project(make_style(i), fields) for i in range(self.styles)])
+        if resource == 'styles':
+            return 200, json.dumps([make_style(int(argument))]).encode()
+        if resource == 'orders':
+            return 200, json.dumps(make_order(argument)).encode()
+        if resource.startswith('trackingdataby'):
+            return 200, json.dumps([make_tracking(number) for number in argument.split(',')]).encode()
+        if resource == 'returns' and method == 'POST':
+            return 200, json.dumps([{'returnInformation': {'raNumber': 'RA1',
+                                                           'returnToAddress': {'city': 'Somewhere'}}}]).encode()
+        return 404, b'{"error": "not found"}'
+
+    def _zendesk(self, method: str, parts: [str], query: dict) -> (int, bytes):
+        if parts:
+            ticket_id = int(parts[0])
+            if method == 'GET':
+                return 200, json.dumps({'ticket': self._ticket(ticket_id)}).encode()
+            return 200, json.dumps({'ticket': {'id': ticket_id}}).encode()
+        if method == 'POST':
+            return 201, json.dumps({'ticket': {'id': self.tickets + 1}}).encode()
+        size = int(query.get('page[size]', [self.page_size])[0])
+        after = int(query.get('page[after]', [self.tickets + 1])[0])
+        ids = range(after - 1, max(0, after - 1 - size), -1)
+        tickets = [self._ticket(i) for i in ids]
+        next_page = None
+        if tickets:
+            next_page = f'{self.url}/api/v2/tickets?page[size]={size}&sort=-id&page[after]={ids[-1]}'
+        return 200, json.dumps({'tickets': tickets,
+                                'meta': {'has_more': ids[-1] > 1 if tickets else False},
+                                'links': {'next': next_page}}).encode()
+
+    def _ticket(self, i: int) -> dict:
+        """Return ticket i; the highest ID is created now and the lowest
+        ticket_days ago.
+        """
+        now = datetime.datetime.utcnow()
+        age = datetime.timedelta(days=self.ticket_days) * (self.tickets - i) / self.tickets
+        return make_ticket(i, now - age)
+
+    def _channeladvisor(self, resource: str, query: dict) -> (int, bytes):
+        if resource.startswith('Orders('):
+            order_id = int(resource[len('Orders('):-1])
+            return 200, json.dumps(make_ca_order(order_id, '2021-09-01')).encode()
+        odata_filter = query.get('$filter', [''])[0]
+        if 'SiteOrderID' in odata_filter:
+            site_order_id = odata_filter.split("'")[1]
+            order_id = int(site_order_id.split('-')[1])
+            return 200, json.dumps({'value': [make_ca_order(order_id, '2021-09-01')]}).encode()
+        skip = int(query.get('$skip', ['0'])[0])
+        select = query.get('$select', [''])[0]
+        expand = query.get('$expand', [''])[0].split(',')
+        orders = [_project(make_ca_order(i, '2021-09-01'), select, expand)
+                  for i in range(skip + 1, min(self.ca_orders, skip + self.page_size) + 1)]
+        data = {'value': orders}
+        if skip + self.page_size < self.ca_orders:
+            next_query = dict(query, **{'$skip': [str(skip + self.page_size)]})
+            data['@odata.nextLink'] = (f'{self.url}/v1/Orders?'
+                                       + urllib.parse.urlencode(next_query, doseq=True))
+        return 200, json.dumps(data).encode()
+
+
+def _project(item: dict, fields: str, expand: [str] = None) -> dict:
+    """Keep only the comma-separated fields (all if empty) and, for
+    ChannelAdvisor, the expanded collections.
+    """
+    if fields:
+        keep = set(fields.split(',')) | set(expand or [])
+        item = {key: value for key, value in item.items() if key in keep}
+    if expand is not None:
+        item = {key: value for key, value in item.items()
+                if key not in ('Items', 'Fulfillments') or key in expand}
+    return item
+
+
+def point_clients_at(url: str, *clients) -> None:
+    """Send the requests of the given clients to the stub at url."""
+    for client in clients:
+        if isinstance(client, ssactivewear.SSActivewear):
+            client._endpoint = url + '/v2/'
+        elif isinstance(client, zendesk.Zendesk):
+            client._url = url + '/api/v2/tickets'
+        elif isinstance(client, channeladvisor.ChannelAdvisor):
+            client._url = url + '/v1/Orders'
+        else:
+            raise TypeError(f'Unknown client {client!r}')
@@ -1,5 +1,18 @@
-from . import github_api
-from . import zendesk
-from . import ssactivewear
-from . import channeladvisor
-from . import database
\ No newline at end of file
+"""Submodules are imported on first access, so that importing one
+client does not pay for the third-party packages of the others.
+"""
+import importlib
+
+_submodules = ('github_api', 'zendesk', 'ssactivewear', 'channeladvisor', 'database',
+               'retry', 'rate_limit', 'instrumentation', 'cassette', 'pricing', 'reconciliation',
+               'tracking_watch', 'catalog_snapshot', 'columnar')
+
+
+def __getattr__(name: str):
+    if name in _submodules:
+        return importlib.import_module(f'.{name}', __name__)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__() -> [str]:
+    return sorted(set(globals()) | set(_submodules))
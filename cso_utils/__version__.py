@@ -7,3 +7,4 @@ __pygithub__ = 'PyGithub<=1.55'
 __pytest__ = 'pytest<=6.2.4'
 __pymysql__ = 'PyMySQL<=1.0.2'
 __beautifulsoup__ = 'beautifulsoup4<=4.10.0'
+__numpy__ = 'numpy<=1.23.3'
@@ -0,0 +1,125 @@
+import contextvars
+import functools
+import inspect
+import itertools
+import time
+
+import requests
+
+from . import cassette as cassettes
+from . import instrumentation
+from . import rate_limit
+from . import retry
+
+_current_operation = contextvars.ContextVar('operation', default=None)
+
+
+def operation(method: 'callable') -> 'callable':
+    """Tag the requests made by the decorated client method with its name,
+    e.g. "SSActivewear.get_products". Nested calls keep the outermost name.
+    Generator methods are tagged each time they are resumed.
+    """
+    if inspect.isgeneratorfunction(method):
+        @functools.wraps(method)
+        def generator_wrapper(self, *args, **kwargs):
+            generator = method(self, *args, **kwargs)
+            name = f'{type(self).__name__}.{method.__name__}'
+            while True:
+                token = _current_operation.set(name) if _current_operation.get() is None else None
+                try:
+                    item = next(generator)
+                except StopIteration:
+                    return
+                finally:
+                    if token is not None:
+                        _current_operation.reset(token)
+                yield item
+        return generator_wrapper
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if _current_operation.get() is not None:
+            return method(self, *args, **kwargs)
+        token = _current_operation.set(f'{type(self).__name__}.{method.__name__}')
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            _current_operation.reset(token)
+    return wrapper
+
+
+class APIClient:
+    """Base class for the API wrappers. Sends every request through
+    the client's RetryPolicy and, if given, waits for its RateLimiter,
+    reports to its Instrumentation and records to or replays from its
+    Cassette on each attempt.
+    """
+    def __init__(self, retry_policy: retry.RetryPolicy = None,
+                 rate_limiter: rate_limit.RateLimiter = None,
+                 hooks: instrumentation.Instrumentation = None,
+                 cassette: cassettes.Cassette = None):
+        self._retry_policy = retry_policy or retry.default_policy
+        self._rate_limiter = rate_limiter
+        self._hooks = hooks
+        self._cassette = cassette
+
+    def _operation(self) -> str:
+        """Return the name of the client method being run."""
+        return _current_operation.get() or f'{type(self).__name__}.request'
+
+    def _request(self, method: str, url: str, retryable: bool = None, **kwargs) -> requests.Response:
+        """Send a request and return the response. retryable=False sends 
+        it only once, whatever its method.
+        """
+        attempts = itertools.count()
+
+        def send_once(method, url, **kwargs):
+            return self._send(method, url, next(attempts), **kwargs)
+
+        return self._retry_policy.send(send_once, method, url, retryable, **kwargs)
+
+    def _send(self, method: str, url: str, attempt: int, **kwargs) -> requests.Response:
+        """Send a single attempt of a request."""
+        # waiting for the rate limiter is not part of the request duration
+        if self._rate_limiter is not None and not self._replaying():
+            self._rate_limiter.acquire(url)
+        if self._hooks is None:
+            return self._transport(method, url, **kwargs)
+
+        info = instrumentation.RequestInfo(self._operation(), method, url, attempt)
+        self._hooks.pre_request(info)
+        start = time.perf_counter()
+        try:
+            response = self._transport(method, url, **kwargs)
+        except Exception as e:
+            info.elapsed = time.perf_counter() - start
+            info.error = e
+            self._hooks.post_request(info)
+            raise
+        info.elapsed = time.perf_counter() - start
+        info.status_code = response.status_code
+        info.response_bytes = len(response.content)
+        self._hooks.post_request(info)
+        return response
+
+    def _transport(self, method: str, url: str, **kwargs) -> requests.Response:
+        """Send a request over the network or replay it from the cassette."""
+        if self._replaying():
+            return self._cassette.play(method, url, **kwargs)
+        response = requests.request(method, url, **kwargs)
+        if self._cassette is not None:
+            self._cassette.record(method, url, response, **kwargs)
+        return response
+
+    def _replaying(self) -> bool:
+        """Return True if requests are replayed from the cassette."""
+        return self._cassette is not None and self._cassette.replaying()
+
+    def _json(self, response: requests.Response) -> dict or list:
+        """Return the decoded body of the response."""
+        if self._hooks is None:
+            return response.json()
+        start = time.perf_counter()
+        data = response.json()
+        self._hooks.json_decoded(self._operation(), time.perf_counter() - start)
+        return data
@@ -0,0 +1,144 @@
+"""Record API traffic to disk and replay it later.
+
+A Cassette in record mode stores every request/response pair made by
+the clients that use it in a gzip-compressed JSON lines file. In replay
+mode it answers the same requests from that file, optionally waiting
+to simulate the network, without contacting the APIs.
+
+Credentials are kept out of the file: auth is sent outside the URL for
+S&S Activewear and Zendesk, and token-like query parameters (such as
+ChannelAdvisor's access_token) are removed from the recorded URLs and
+from URLs inside recorded responses, such as @odata.nextLink. Secrets
+elsewhere in a response body are recorded as is.
+"""
+import base64
+import collections
+import gzip
+import json
+import re
+import threading
+import time
+import urllib.parse
+
+import requests
+import requests.structures
+
+SECRET_PARAMS = frozenset({'access_token', 'token', 'password', 'api_key'})
+URL_PATTERN = re.compile(r'https?://[^\s"\'<>]+')
+
+
+class CassetteMissError(LookupError):
+    """Raised in replay mode when a request was not recorded."""
+
+
+class Cassette:
+    """Record or replay the requests made by the clients.
+
+    Args:
+        path: File to write to (record mode) or read from (replay mode).
+        mode: 'record' or 'replay'.
+        latency: Seconds to wait before returning each replayed response.
+        recorded_latency: If True, also wait as long as the original
+            request took when it was recorded.
+    """
+    def __init__(self, path: str, mode: 'record' or 'replay' = 'replay',
+                 latency: float = 0, recorded_latency: bool = False):
+        if mode not in ('record', 'replay'):
+            raise ValueError("Mode not recognized. Please use 'record' or 'replay'")
+        self._path = path
+        self._mode = mode
+        self._latency = latency
+        self._recorded_latency = recorded_latency
+        self._lock = threading.Lock()
+        self._file = None
+        self._interactions = collections.defaultdict(collections.deque)
+        if mode == 'record':
+            self._file = gzip.open(path, 'wt', encoding='utf-8')
+        else:
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                for line in f:
+                    interaction = json.loads(line)
+                    key = _key(interaction['method'], interaction['url'], interaction['body'])
+                    self._interactions[key].append(interaction)
+
+    def __enter__(self) -> 'Cassette':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def replaying(self) -> bool:
+        """Return True if in replay mode, False otherwise."""
+        return self._mode == 'replay'
+
+    def close(self) -> None:
+        """Finish writing the cassette."""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def record(self, method: str, url: str, response: requests.Response, **kwargs) -> None:
+        """Store the request and its response."""
+        content = response.content or b''
+        interaction = {'method': method.upper(),
+                       'url': scrub_url(url),
+                       'body': kwargs.get('json'),
+                       'status_code': response.status_code,
+                       'reason': response.reason,
+                       'headers': {key: scrub_urls_in(value) for key, value in response.headers.items()
+                                   if key.lower() != 'set-cookie'},
+                       'elapsed': response.elapsed.total_seconds() if response.elapsed else 0}
+        try:
+            interaction['content'] = scrub_urls_in(content.decode('utf-8'))
+        except UnicodeDecodeError:
+            interaction['content_base64'] = base64.b64encode(content).decode('ascii')
+        with self._lock:
+            self._file.write(json.dumps(interaction) + '\n')
+
+    def play(self, method: str, url: str, **kwargs) -> requests.Response:
+        """Return the recorded response to the request. Identical requests
+        get their responses in recorded order; the last one is repeated.
+        """
+        key = _key(method.upper(), scrub_url(url), kwargs.get('json'))
+        with self._lock:
+            recorded = self._interactions.get(key)
+            if not recorded:
+                raise CassetteMissError(f'No recorded response for {method.upper()} {scrub_url(url)}')
+            interaction = recorded.popleft() if len(recorded) > 1 else recorded[0]
+        delay = self._latency + (interaction['elapsed'] if self._recorded_latency else 0)
+        if delay:
+            time.sleep(delay)
+        return _response(url, interaction)
+
+
+def scrub_url(url: str) -> str:
+    """Return the URL without secret query parameters."""
+    split = urllib.parse.urlsplit(url)
+    query = [param for param in split.query.split('&')
+             if param and param.split('=')[0].lower() not in SECRET_PARAMS]
+    return urllib.parse.urlunsplit(split._replace(query='&'.join(query)))
+
+
+def scrub_urls_in(text: str) -> str:
+    """Return the text with secret query parameters removed from the URLs in it."""
+    return URL_PATTERN.sub(lambda match: scrub_url(match.group()) if '?' in match.group() else match.group(), text)
+
+
+def _key(method: str, url: str, body: dict or list or None) -> (str, str, str):
+    return (method, url, json.dumps(body, sort_keys=True))
+
+
+def _response(url: str, interaction: dict) -> requests.Response:
+    """Build a requests.Response from a recorded interaction."""
+    response = requests.Response()
+    response.status_code = interaction['status_code']
+    response.reason = interaction['reason']
+    response.headers = requests.structures.CaseInsensitiveDict(interaction['headers'])
+    response.url = url
+    if 'content' in interaction:
+        response._content = interaction['content'].encode('utf-8')
+    else:
+        response._content = base64.b64decode(interaction['content_base64'])
+    response.encoding = requests.utils.get_encoding_from_headers(response.headers) or 'utf-8'
+    return response
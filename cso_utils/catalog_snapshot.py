@@ -0,0 +1,201 @@
+"""Share the S&S Activewear catalog between processes through one file.
+
+write_snapshot() stores products and styles in a compact binary file:
+a header, the records (key followed by compact JSON) and one
+open-addressing hash table per kind. CatalogSnapshot memory-maps the file,
+so every process on a host reads the same pages from the page cache
+instead of holding its own copy of get_products() and get_styles().
+Lookups hash the key with zlib.crc32 and probe the table in place, and
+the JSON of a record is only decoded when its data is first used.
+
+A snapshot is written to a temporary file in the same directory and
+moved over the old one with os.replace(), so readers see either the old
+file or the new one, never a partial file. Readers pick up a new
+snapshot with reload_if_changed().
+"""
+import json
+import mmap
+import os
+import struct
+import tempfile
+import zlib
+
+from . import ssactivewear
+
+MAGIC = b'CSOCAT01'
+HEADER = struct.Struct('<8sQQQQQQ')  # magic, then offset, slots and records of the product and style tables
+SLOT = struct.Struct('<IIIQ')  # key hash, key length, data length, record offset (0 if empty)
+
+
+class _LazyData:
+    """Decode the record from the snapshot on first access of _data."""
+    def __init__(self, buffer: mmap.mmap, start: int, end: int):
+        self._buffer = buffer
+        self._start = start
+        self._end = end
+        self._decoded = None
+
+    @property
+    def _data(self) -> dict:
+        if self._decoded is None:
+            self._decoded = json.loads(self._buffer[self._start:self._end])
+        return self._decoded
+
+
+class SnapshotProduct(_LazyData, ssactivewear.Product):
+    """A Product read from a CatalogSnapshot."""
+
+
+class SnapshotStyle(_LazyData, ssactivewear.Style):
+    """A Style read from a CatalogSnapshot."""
+
+
+def export_catalog(ss_api: ssactivewear.SSActivewear, path: str,
+                   product_fields: [str] = None, style_fields: [str] = None) -> None:
+    """Download all products and styles and write them to a snapshot.
+    Only the given fields are stored if product_fields or style_fields is given.
+    """
+    write_snapshot(path, ss_api.get_products(product_fields), ss_api.get_styles(style_fields))
+
+
+def write_snapshot(path: str,
+                   products: {str: ssactivewear.Product} or [ssactivewear.Product],
+                   styles: {int: ssactivewear.Style} or [ssactivewear.Style] = ()) -> None:
+    """Write the products and styles to a snapshot at path, atomically
+    replacing any existing snapshot.
+    """
+    if isinstance(products, dict):
+        products = products.values()
+    if isinstance(styles, dict):
+        styles = styles.values()
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix='.catalog-', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(bytes(HEADER.size))
+            product_table = _write_section(f, ((item.data()['sku'], item.data()) for item in products))
+            style_table = _write_section(f, ((item.data()['styleID'], item.data()) for item in styles))
+            f.seek(0)
+            f.write(HEADER.pack(MAGIC, *product_table, *style_table))
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def _write_section(f: 'file', items: 'iterable') -> (int, int, int):
+    """Write the records and the hash table of one kind and return
+    (table offset, number of slots, number of records).
+    """
+    entries = []
+    for key, data in items:
+        key = str(key).encode()
+        record = json.dumps(data, separators=(',', ':')).encode()
+        entries.append((zlib.crc32(key), len(key), len(record), f.tell()))
+        f.write(key)
+        f.write(record)
+
+    slots = 1
+    while slots < 2 * len(entries):
+        slots *= 2
+    table = [None] * slots
+    for entry in entries:
+        i = entry[0] & (slots - 1)
+        while table[i] is not None:
+            i = (i + 1) & (slots - 1)
+        table[i] = entry
+    offset = f.tell()
+    empty = SLOT.pack(0, 0, 0, 0)
+    f.write(b''.join(empty if entry is None else SLOT.pack(*entry) for entry in table))
+    return offset, slots, len(entries)
+
+
+class CatalogSnapshot:
+    def __init__(self, path: str):
+        self._path = path
+        self._open()
+
+    def __enter__(self) -> 'CatalogSnapshot':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _open(self) -> None:
+        with open(self._path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, *tables = HEADER.unpack_from(buffer) if len(buffer) >= HEADER.size else (None,)
+        if magic != MAGIC:
+            buffer.close()
+            raise ValueError(f'not a catalog snapshot: {self._path}')
+        # views returned earlier keep a reference to the previous buffer,
+        # so it is left to be unmapped once they are gone
+        self._buffer = buffer
+        self._products = tuple(tables[:3])
+        self._styles = tuple(tables[3:])
+        self._stat = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def close(self) -> None:
+        """Unmap the snapshot."""
+        self._buffer.close()
+
+    def reload_if_changed(self) -> bool:
+        """Map the snapshot again if it was replaced and return whether it was."""
+        stat = os.stat(self._path)
+        if (stat.st_ino, stat.st_mtime_ns, stat.st_size) == self._stat:
+            return False
+        self._open()
+        return True
+
+    def get_product(self, sku: str) -> SnapshotProduct:
+        """Return the Product for the given sku. Raise KeyError if there is none."""
+        start, end = self._find(self._products, sku)
+        return SnapshotProduct(self._buffer, start, end)
+
+    def get_style(self, style_id: int) -> SnapshotStyle:
+        """Return the Style for the given style ID. Raise KeyError if there is none."""
+        start, end = self._find(self._styles, style_id)
+        return SnapshotStyle(self._buffer, start, end)
+
+    def products(self) -> 'generator':
+        """Yield every Product in the snapshot."""
+        for start, end in self._records(self._products):
+            yield SnapshotProduct(self._buffer, start, end)
+
+    def styles(self) -> 'generator':
+        """Yield every Style in the snapshot."""
+        for start, end in self._records(self._styles):
+            yield SnapshotStyle(self._buffer, start, end)
+
+    def _find(self, table: (int, int, int), key: str or int) -> (int, int):
+        """Return the start and end of the JSON of the record with the given key."""
+        offset, slots, _ = table
+        encoded = str(key).encode()
+        key_hash = zlib.crc32(encoded)
+        i = key_hash & (slots - 1)
+        buffer = self._buffer
+        while True:
+            slot_hash, key_length, length, start = SLOT.unpack_from(buffer, offset + i * SLOT.size)
+            if start == 0:
+                raise KeyError(key)
+            if (slot_hash == key_hash and key_length == len(encoded)
+                    and buffer[start:start + key_length] == encoded):
+                return start + key_length, start + key_length + length
+            i = (i + 1) & (slots - 1)
+
+    def _records(self, table: (int, int, int)) -> 'generator':
+        """Yield the start and end of the JSON of every record in the table."""
+        offset, slots, _ = table
+        buffer = self._buffer
+        for i in range(slots):
+            _, key_length, length, start = SLOT.unpack_from(buffer, offset + i * SLOT.size)
+            if start:
+                yield start + key_length, start + key_length + length
+
+    def __len__(self) -> int:
+        """Return the number of products."""
+        return self._products[2]
@@ -1,7 +1,10 @@
 import datetime
 
-import requests
-
+from . import api_client
+from . import cassette as cassettes
+from . import instrumentation
+from . import rate_limit
+from . import retry
 from . import stored_data
 
 class ChannelAdvisorOrder(stored_data.StoredData):
@@ -37,34 +40,64 @@ class ChannelAdvisorOrder(stored_data.StoredData):
         return self._data['ShippingStatus']
 
 
-class ChannelAdvisor:
-    def __init__(self, token: str):
+class ChannelAdvisor(api_client.APIClient):
+    def __init__(self, token: str, retry_policy: retry.RetryPolicy = None,
+                 rate_limiter: rate_limit.RateLimiter = None,
+                 hooks: instrumentation.Instrumentation = None,
+                 cassette: cassettes.Cassette = None):
+        super().__init__(retry_policy, rate_limiter, hooks, cassette)
         self._token = token
+        self._url = 'https://api.channeladvisor.com/v1/Orders'
 
-    def get_order(self, site_order_id_or_po: str) -> ChannelAdvisorOrder:
+    @api_client.operation
+    def get_order(self, site_order_id_or_po: str, fields: [str] = None, 
+                  expand: [str] = ('Items', 'Fulfillments')) -> ChannelAdvisorOrder:
         """Return a ChannelAdvisorOrder object representing the order 
-        with the given order ID or PO number.
+        with the given order ID or PO number. Only the given fields 
+        (and ID) are requested if fields is given, and only the given 
+        related collections are expanded.
         """
         if len(site_order_id_or_po) > 8:
-            endpoint = f"https://api.channeladvisor.com/v1/Orders?access_token={self._token}&$expand=Items,Fulfillments&$filter=SiteOrderID eq '{site_order_id_or_po}'"
-            response = requests.get(endpoint)
+            endpoint = f"{self._url}?access_token={self._token}&$select=ID&$filter=SiteOrderID eq '{site_order_id_or_po}'"
+            response = self._request('GET', endpoint)
             response.raise_for_status()
-            site_order_id_or_po = response.json()['value'][0]['ID']
-        endpoint = f"https://api.channeladvisor.com/v1/Orders({site_order_id_or_po})?access_token={self._token}&$expand=Items,Fulfillments"
-        response = requests.get(endpoint)
+            site_order_id_or_po = self._json(response)['value'][0]['ID']
+        endpoint = f"{self._url}({site_order_id_or_po})?access_token={self._token}{self._projection(fields, expand)}"
+        response = self._request('GET', endpoint)
         response.raise_for_status()
-        return ChannelAdvisorOrder(response.json())
+        return ChannelAdvisorOrder(self._json(response))
+
+    @api_client.operation
+    def get_orders_shipped_on(self, month: int, day: int, year: int, fields: [str] = None, 
+                              expand: [str] = ('Items', 'Fulfillments')) -> [ChannelAdvisorOrder]:
+        """Return a list of orders shipped on the given date. fields and 
+        expand limit the response as in get_order.
+        """
+        return list(self.iter_orders_shipped_on(month, day, year, fields, expand))
 
-    def get_orders_shipped_on(self, month: int, day: int, year: int) -> [ChannelAdvisorOrder]:
-        """Return a list of orders shipped on the given date."""
-        orders = []
-        endpoint = f"https://api.channeladvisor.com/v1/Orders?access_token={self._token}&$expand=Items,Fulfillments&$filter=ShippingDateUtc eq {year}-{month}-{day} and ShippingStatus eq 'Shipped'"
+    @api_client.operation
+    def iter_orders_shipped_on(self, month: int, day: int, year: int, fields: [str] = None, 
+                               expand: [str] = ('Items', 'Fulfillments')) -> 'generator':
+        """Yield the orders shipped on the given date, fetching one page at a time. 
+        fields and expand limit the response as in get_order.
+        """
+        endpoint = f"{self._url}?access_token={self._token}{self._projection(fields, expand)}&$filter=ShippingDateUtc eq {year}-{month}-{day} and ShippingStatus eq 'Shipped'"
         while True:
-            response = requests.get(endpoint)
+            response = self._request('GET', endpoint)
             response.raise_for_status()
-            data = response.json()
-            orders.extend([ChannelAdvisorOrder(item) for item in data['value']])
+            data = self._json(response)
+            for item in data['value']:
+                yield ChannelAdvisorOrder(item)
             endpoint = data.get('@odata.nextLink')
             if not endpoint:
                 break
-        return orders
\ No newline at end of file
+
+    def _projection(self, fields: [str] or None, expand: [str]) -> str:
+        """Return the OData $select and $expand query options."""
+        query = ''
+        if fields is not None:
+            fields = ['ID'] + [field for field in fields if field != 'ID']
+            query += '&$select=' + ','.join(fields)
+        if expand:
+            query += '&$expand=' + ','.join(expand)
+        return query
\ No newline at end of file
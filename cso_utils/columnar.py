@@ -0,0 +1,175 @@
+"""Export order lines and tickets as columns for analytics.
+
+Instead of building one dict per line, the values are appended straight
+from the raw JSON to one array per column: array.array for numbers and
+lists for strings and optional IDs. Rows are handed out in chunks of
+"chunk_size", so exports of any length written with write_csv() or
+write_parquet() use about the same memory. pyarrow is only needed for
+Parquet and is imported when write_parquet() is called.
+"""
+import array
+import csv
+
+CA_ORDER_LINES = 'ca_order_lines'
+SS_ORDER_LINES = 'ss_order_lines'
+TICKETS = 'tickets'
+
+# column name and type: 'int' and 'float' are stored in array.array,
+# 'str' and 'optional int' in lists
+COLUMNS = {CA_ORDER_LINES: (('po_number', 'str'),
+                            ('site_name', 'str'),
+                            ('sku', 'str'),
+                            ('title', 'str'),
+                            ('qty', 'int'),
+                            ('unit_price', 'float'),
+                            ('unit_estimated_shipping_cost', 'float')),
+           SS_ORDER_LINES: (('po_number', 'str'),
+                            ('invoice', 'str'),
+                            ('sku', 'str'),
+                            ('qty_ordered', 'int'),
+                            ('qty_shipped', 'int')),
+           TICKETS: (('id', 'int'),
+                     ('subject', 'str'),
+                     ('status', 'str'),
+                     ('created_at', 'str'),
+                     ('updated_at', 'str'),
+                     ('requester_id', 'optional int'),
+                     ('assignee_id', 'optional int'),
+                     ('group_id', 'optional int'),
+                     ('organization_id', 'optional int'),
+                     ('tags', 'str'))}
+
+
+def to_columns(kind: 'ca_order_lines' or 'ss_order_lines' or 'tickets', items: 'iterable') -> {str: list or array.array}:
+    """Return all rows of the items as {column name: values}.
+    items are ChannelAdvisorOrder, Order or Ticket objects depending on kind.
+    """
+    columns = _new_columns(kind)
+    _APPEND[kind](items, columns)
+    return columns
+
+
+def iter_columns(kind: 'ca_order_lines' or 'ss_order_lines' or 'tickets', items: 'iterable',
+                 chunk_size: int = 100000) -> 'generator':
+    """Yield {column name: values} for every "chunk_size" rows of the items
+    (a chunk ends after the order that reaches chunk_size), consuming the
+    items as they are needed.
+    """
+    append = _APPEND[kind]
+    columns = _new_columns(kind)
+    rows = next(iter(columns.values()))
+    for item in items:
+        append((item,), columns)
+        if len(rows) >= chunk_size:
+            yield columns
+            columns = _new_columns(kind)
+            rows = next(iter(columns.values()))
+    if rows:
+        yield columns
+
+
+def write_csv(path: str, kind: 'ca_order_lines' or 'ss_order_lines' or 'tickets', items: 'iterable',
+              chunk_size: int = 100000) -> int:
+    """Write the rows of the items to a CSV file with a header and
+    return the number of rows written.
+    """
+    written = 0
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow([name for name, _ in COLUMNS[kind]])
+        for columns in iter_columns(kind, items, chunk_size):
+            writer.writerows(zip(*columns.values()))
+            written += len(next(iter(columns.values())))
+    return written
+
+
+def write_parquet(path: str, kind: 'ca_order_lines' or 'ss_order_lines' or 'tickets', items: 'iterable',
+                  chunk_size: int = 100000) -> int:
+    """Write the rows of the items to a Parquet file, one row group per
+    chunk, and return the number of rows written. Requires pyarrow.
+    """
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError('write_parquet requires pyarrow, install it with "pip install pyarrow"') from None
+
+    types = {'int': pyarrow.int64(), 'float': pyarrow.float64(),
+             'str': pyarrow.string(), 'optional int': pyarrow.int64()}
+    schema = pyarrow.schema([(name, types[column_type]) for name, column_type in COLUMNS[kind]])
+    written = 0
+    with pyarrow.parquet.ParquetWriter(path, schema) as writer:
+        for columns in iter_columns(kind, items, chunk_size):
+            writer.write_table(pyarrow.table([pyarrow.array(values, type=field.type)
+                                              for values, field in zip(columns.values(), schema)],
+                                             schema=schema))
+            written += len(next(iter(columns.values())))
+    return written
+
+
+def _new_columns(kind: str) -> {str: list or array.array}:
+    """Return empty columns for the kind."""
+    columns = dict()
+    for name, column_type in COLUMNS[kind]:
+        if column_type == 'int':
+            columns[name] = array.array('q')
+        elif column_type == 'float':
+            columns[name] = array.array('d')
+        else:
+            columns[name] = []
+    return columns
+
+
+def _append_ca_order_lines(orders: 'iterable', columns: dict) -> None:
+    """Append the items of the ChannelAdvisorOrder objects."""
+    po_number, site_name, sku, title, qty, unit_price, shipping = columns.values()
+    for order in orders:
+        data = order.data()
+        order_po_number = str(data['ID'])
+        order_site_name = data.get('SiteName')
+        for item in data['Items']:
+            po_number.append(order_po_number)
+            site_name.append(order_site_name)
+            sku.append(item['Sku'])
+            title.append(item['Title'])
+            qty.append(item['Quantity'])
+            unit_price.append(item['UnitPrice'])
+            shipping.append(item['UnitEstimatedShippingCost'])
+
+
+def _append_ss_order_lines(orders: 'iterable', columns: dict) -> None:
+    """Append the lines of the S&S Activewear Order objects."""
+    po_number, invoice, sku, qty_ordered, qty_shipped = columns.values()
+    for order in orders:
+        for package in order.data():
+            package_po_number = package['poNumber']
+            package_invoice = package['invoiceNumber']
+            for line in package['lines']:
+                po_number.append(package_po_number)
+                invoice.append(package_invoice)
+                sku.append(line['sku'])
+                qty_ordered.append(line['qtyOrdered'])
+                qty_shipped.append(line.get('qtyShipped', 0))
+
+
+def _append_tickets(tickets: 'iterable', columns: dict) -> None:
+    """Append the Ticket objects."""
+    (id_num, subject, status, created_at, updated_at,
+     requester_id, assignee_id, group_id, organization_id, tags) = columns.values()
+    for ticket in tickets:
+        data = ticket.data()
+        id_num.append(data['id'])
+        subject.append(data.get('subject'))
+        status.append(data.get('status'))
+        created_at.append(data['created_at'])
+        updated_at.append(data.get('updated_at'))
+        requester_id.append(data.get('requester_id'))
+        assignee_id.append(data.get('assignee_id'))
+        group_id.append(data.get('group_id'))
+        organization_id.append(data.get('organization_id'))
+        tags.append(' '.join(data.get('tags', ())))
+
+
+_APPEND = {CA_ORDER_LINES: _append_ca_order_lines,
+           SS_ORDER_LINES: _append_ss_order_lines,
+           TICKETS: _append_tickets}
@@ -1,7 +1,6 @@
 import traceback
 
 import requests
-import github
 
 
 
@@ -39,6 +38,8 @@ def create_bug_report(token: str, repo_name: str, given_info: str = '') -> None:
 
     body = '\n'.join(error)
 
+    import github
+
     g = github.Github(token)
     repo = g.get_repo('clothingshoponline/' + repo_name)
     issue = repo.create_issue(title=title, body=f'<pre>{body}</pre>')
@@ -0,0 +1,194 @@
+"""Hooks for observing the requests made by the API clients.
+
+Clients given an Instrumentation call its pre-request callbacks before
+every attempt of a request, its post-request callbacks after it, and its
+JSON callbacks after decoding a response. Each event is tagged with the
+logical client method that made it (e.g. "SSActivewear.get_products").
+A MetricsCollector can be attached to record latency histograms, counts,
+status codes, response sizes and JSON decode times per method.
+"""
+import bisect
+import threading
+
+
+class RequestInfo:
+    """Describe one attempt of a request. The URL is stored without its
+    query string so that tokens are not leaked into metrics.
+    """
+    def __init__(self, operation: str, method: str, url: str, attempt: int):
+        self.operation = operation
+        self.method = method
+        self.url = url.split('?')[0]
+        self.attempt = attempt
+        self.status_code = None
+        self.elapsed = None
+        self.response_bytes = None
+        self.error = None
+
+    def __repr__(self) -> str:
+        return (f'{type(self).__name__}({self.operation!r}, {self.method!r}, {self.url!r}, '
+                f'attempt={self.attempt}, status_code={self.status_code}, elapsed={self.elapsed})')
+
+
+class Instrumentation:
+    """Hold the callbacks called by the clients.
+
+    Callbacks are called as:
+        pre_request(info: RequestInfo)
+        post_request(info: RequestInfo)  # status_code, elapsed, response_bytes or error set
+        json_decoded(operation: str, seconds: float)
+    """
+    def __init__(self):
+        self._pre_request = []
+        self._post_request = []
+        self._json_decoded = []
+
+    def add_pre_request(self, callback: 'callable') -> None:
+        """Call callback(info) before every attempt of a request."""
+        self._pre_request.append(callback)
+
+    def add_post_request(self, callback: 'callable') -> None:
+        """Call callback(info) after every attempt of a request."""
+        self._post_request.append(callback)
+
+    def add_json_decoded(self, callback: 'callable') -> None:
+        """Call callback(operation, seconds) after a response is decoded."""
+        self._json_decoded.append(callback)
+
+    def attach(self, collector: 'MetricsCollector') -> None:
+        """Record every request and JSON decode in the given collector."""
+        self.add_post_request(collector.record_request)
+        self.add_json_decoded(collector.record_json_decode)
+
+    def pre_request(self, info: RequestInfo) -> None:
+        for callback in self._pre_request:
+            callback(info)
+
+    def post_request(self, info: RequestInfo) -> None:
+        for callback in self._post_request:
+            callback(info)
+
+    def json_decoded(self, operation: str, seconds: float) -> None:
+        for callback in self._json_decoded:
+            callback(operation, seconds)
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Histogram:
+    """Cumulative-friendly histogram of observed values."""
+    def __init__(self, buckets: (float,) = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def as_dict(self) -> dict:
+        """Return {'buckets': {upper bound: cumulative count}, 'sum': float, 'count': int}."""
+        cumulative = dict()
+        running = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            running += count
+            cumulative[bound] = running
+        return {'buckets': cumulative, 'sum': self.total, 'count': self.count}
+
+
+class _OperationStats:
+    def __init__(self, buckets: (float,)):
+        self.requests = 0
+        self.retries = 0
+        self.errors = 0
+        self.statuses = dict()
+        self.response_bytes = 0
+        self.latency = Histogram(buckets)
+        self.json_decode = Histogram(buckets)
+
+
+class MetricsCollector:
+    """Collect request metrics per logical client method."""
+    def __init__(self, buckets: (float,) = DEFAULT_BUCKETS):
+        self._buckets = buckets
+        self._stats = dict()
+        self._lock = threading.Lock()
+
+    def _operation(self, operation: str) -> _OperationStats:
+        if operation not in self._stats:
+            self._stats[operation] = _OperationStats(self._buckets)
+        return self._stats[operation]
+
+    def record_request(self, info: RequestInfo) -> None:
+        """Record a finished attempt of a request."""
+        with self._lock:
+            stats = self._operation(info.operation)
+            stats.requests += 1
+            if info.attempt > 0:
+                stats.retries += 1
+            if info.error is not None:
+                stats.errors += 1
+            else:
+                stats.statuses[info.status_code] = stats.statuses.get(info.status_code, 0) + 1
+                stats.response_bytes += info.response_bytes or 0
+            stats.latency.observe(info.elapsed)
+
+    def record_json_decode(self, operation: str, seconds: float) -> None:
+        """Record the time taken to decode a response."""
+        with self._lock:
+            self._operation(operation).json_decode.observe(seconds)
+
+    def reset(self) -> None:
+        """Forget everything recorded so far."""
+        with self._lock:
+            self._stats = dict()
+
+    def as_dict(self) -> {str: dict}:
+        """Return the metrics as {operation: metrics}."""
+        with self._lock:
+            return {operation: {'requests': stats.requests,
+                                'retries': stats.retries,
+                                'errors': stats.errors,
+                                'statuses': dict(stats.statuses),
+                                'response_bytes': stats.response_bytes,
+                                'latency_seconds': stats.latency.as_dict(),
+                                'json_decode_seconds': stats.json_decode.as_dict()}
+                    for operation, stats in self._stats.items()}
+
+    def to_prometheus(self, prefix: str = 'cso_utils') -> str:
+        """Return the metrics in the Prometheus text exposition format."""
+        metrics = self.as_dict()
+        lines = []
+
+        def counter(name, help_text, samples):
+            lines.append(f'# HELP {prefix}_{name} {help_text}')
+            lines.append(f'# TYPE {prefix}_{name} counter')
+            for labels, value in samples:
+                lines.append(f'{prefix}_{name}{{{labels}}} {value}')
+
+        def histogram(name, help_text, key):
+            lines.append(f'# HELP {prefix}_{name} {help_text}')
+            lines.append(f'# TYPE {prefix}_{name} histogram')
+            for operation, data in metrics.items():
+                labels = f'operation="{operation}"'
+                for bound, count in data[key]['buckets'].items():
+                    lines.append(f'{prefix}_{name}_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f'{prefix}_{name}_sum{{{labels}}} {data[key]["sum"]}')
+                lines.append(f'{prefix}_{name}_count{{{labels}}} {data[key]["count"]}')
+
+        counter('requests_total', 'Requests sent, including retries.',
+                [(f'operation="{operation}",status="{status}"', count)
+                 for operation, data in metrics.items()
+                 for status, count in data['statuses'].items()])
+        counter('request_errors_total', 'Requests that failed without a response.',
+                [(f'operation="{operation}"', data['errors']) for operation, data in metrics.items()])
+        counter('request_retries_total', 'Requests that were retries.',
+                [(f'operation="{operation}"', data['retries']) for operation, data in metrics.items()])
+        counter('response_bytes_total', 'Bytes received in response bodies.',
+                [(f'operation="{operation}"', data['response_bytes']) for operation, data in metrics.items()])
+        histogram('request_duration_seconds', 'Time taken by each request.', 'latency_seconds')
+        histogram('json_decode_seconds', 'Time taken to decode each response.', 'json_decode_seconds')
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,126 @@
+"""Bulk pricing over the S&S Activewear catalog.
+
+A PriceMatrix holds the piece, case and sale prices of every product
+in NumPy arrays so that quotes with millions of lines are priced with
+vectorized operations instead of one Product lookup per line.
+
+Requires NumPy, installed with the "pricing" extra.
+"""
+try:
+    import numpy
+except ImportError:
+    raise ImportError('cso_utils.pricing requires numpy, install it with "pip install numpy" '
+                      'or the "pricing" extra') from None
+
+from . import ssactivewear
+from . import stored_data
+
+
+class Quote(stored_data.StoredData):
+    """Prices of a batch of lines. data() returns a dict of NumPy arrays."""
+    def unit_prices(self) -> numpy.ndarray:
+        """Return the average price per piece of each line."""
+        qtys = self._data['qtys']
+        return numpy.divide(self._data['line_totals'], qtys,
+                            out=numpy.zeros(len(qtys)), where=qtys != 0)
+
+    def line_totals(self) -> numpy.ndarray:
+        """Return the total price of each line."""
+        return self._data['line_totals']
+
+    def order_totals(self) -> {str: float}:
+        """Return the total price of each order as {order ID: total}."""
+        return dict(zip(self._data['order_ids'].tolist(), self._data['order_totals'].tolist()))
+
+    def total(self) -> float:
+        """Return the total price of all lines."""
+        return float(self._data['line_totals'].sum())
+
+
+class PriceMatrix:
+    """Prices of every product, indexed by sku.
+
+    Full cases are priced at the case price and the remaining pieces at
+    the piece price. A sale price, when set, is used instead if it is lower.
+    """
+    def __init__(self, skus: [str], piece_prices: [float], case_prices: [float],
+                 sale_prices: [float], case_qtys: [int]):
+        self._skus = list(skus)
+        self._index = {sku: i for i, sku in enumerate(self._skus)}
+        self._piece = numpy.asarray(piece_prices, dtype=numpy.float64)
+        self._case = numpy.asarray(case_prices, dtype=numpy.float64)
+        self._sale = numpy.asarray(sale_prices, dtype=numpy.float64)
+        self._case_qty = numpy.asarray(case_qtys, dtype=numpy.int64)
+
+    @classmethod
+    def from_products(cls, products: {str: ssactivewear.Product} or [ssactivewear.Product]) -> 'PriceMatrix':
+        """Build a PriceMatrix from the result of SSActivewear.get_products()
+        or a list of Product objects.
+        """
+        if isinstance(products, dict):
+            products = products.values()
+        data = [product.data() for product in products]
+        return cls([item['sku'] for item in data],
+                   [item.get('piecePrice') or 0 for item in data],
+                   [item.get('casePrice') or item.get('piecePrice') or 0 for item in data],
+                   [item.get('salePrice') or 0 for item in data],
+                   [item.get('caseQty') or 0 for item in data])
+
+    def __len__(self) -> int:
+        return len(self._skus)
+
+    def indices(self, skus: [str]) -> numpy.ndarray:
+        """Return the row of each sku. Raise KeyError for unknown skus."""
+        try:
+            return numpy.fromiter(map(self._index.__getitem__, skus), dtype=numpy.intp, count=len(skus))
+        except KeyError as e:
+            raise KeyError(f'sku not in catalog: {e.args[0]}') from None
+
+    def line_totals(self, skus: [str] or numpy.ndarray, qtys: [int]) -> numpy.ndarray:
+        """Return the total price of each line. skus may also be the
+        rows returned by indices() to price the same lines repeatedly.
+        """
+        rows = skus if isinstance(skus, numpy.ndarray) and skus.dtype.kind in 'iu' else self.indices(skus)
+        qtys = numpy.asarray(qtys, dtype=numpy.int64)
+        case_qty = self._case_qty[rows]
+        full_case_pieces = numpy.where(case_qty > 0, qtys - qtys % numpy.maximum(case_qty, 1), 0)
+        totals = (full_case_pieces * self._case[rows]
+                  + (qtys - full_case_pieces) * self._piece[rows])
+        sale = self._sale[rows]
+        on_sale = sale > 0
+        return numpy.where(on_sale, numpy.minimum(totals, sale * qtys), totals)
+
+    @staticmethod
+    def order_codes(order_ids: [str]) -> (numpy.ndarray, [str]):
+        """Return the position of each line's order ID in the list of
+        distinct order IDs (in order of first appearance), and that list.
+        """
+        codes = dict.fromkeys(order_ids)
+        for code, order_id in enumerate(codes):
+            codes[order_id] = code
+        return (numpy.fromiter(map(codes.__getitem__, order_ids), dtype=numpy.intp, count=len(order_ids)),
+                list(codes))
+
+    def quote(self, skus: [str] or numpy.ndarray, qtys: [int],
+              order_ids: [str] or numpy.ndarray = None) -> Quote:
+        """Price the lines and, if order_ids (one per line) is given,
+        total them per order. order_ids may also be integer codes such
+        as those returned by order_codes(); the totals are then keyed by code.
+        """
+        qtys = numpy.asarray(qtys, dtype=numpy.int64)
+        line_totals = self.line_totals(skus, qtys)
+        if order_ids is None:
+            unique_ids = numpy.asarray([])
+            order_totals = numpy.asarray([])
+        else:
+            if isinstance(order_ids, numpy.ndarray) and order_ids.dtype.kind in 'iu':
+                codes = order_ids
+                unique_ids = numpy.arange(codes.max() + 1 if len(codes) else 0)
+            else:
+                codes, unique_ids = self.order_codes(order_ids)
+                unique_ids = numpy.asarray(unique_ids)
+            order_totals = numpy.bincount(codes, weights=line_totals, minlength=len(unique_ids))
+        return Quote({'qtys': qtys,
+                      'line_totals': line_totals,
+                      'order_ids': unique_ids,
+                      'order_totals': order_totals})
@@ -0,0 +1,120 @@
+"""Token-bucket rate limiting for API requests.
+
+A TokenBucket is shared by the threads of one process. A SQLiteTokenBucket
+keeps its state in a local SQLite file so that every process using the
+same file and bucket name draws from the same budget. A RateLimiter maps
+API hosts to buckets and is consulted by the clients before each request.
+"""
+import sqlite3
+import threading
+import time
+import urllib.parse
+
+
+class TokenBucket:
+    """Allow "rate" requests per second on average, with bursts of
+    up to "capacity" requests. Shared by all threads of a process.
+    """
+    def __init__(self, rate: float, capacity: float = 1):
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_acquire(self, tokens: float = 1) -> float:
+        """Take the tokens if available and return 0, otherwise return
+        the number of seconds to wait before trying again.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+            self._updated = now
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0
+            return (tokens - self._tokens) / self._rate
+
+    def acquire(self, tokens: float = 1) -> None:
+        """Block until the tokens are available and take them."""
+        wait = self.try_acquire(tokens)
+        while wait:
+            time.sleep(wait)
+            wait = self.try_acquire(tokens)
+
+
+class SQLiteTokenBucket(TokenBucket):
+    """A TokenBucket whose state is stored in a SQLite file, shared by
+    every thread and process that uses the same path and name.
+    """
+    def __init__(self, path: str, name: str, rate: float, capacity: float = 1):
+        self._path = path
+        self._name = name
+        self._rate = rate
+        self._capacity = capacity
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=60, isolation_level=None,
+                                           check_same_thread=False)
+        with self._lock:
+            self._connection.execute('CREATE TABLE IF NOT EXISTS buckets '
+                                     '(name TEXT PRIMARY KEY, tokens REAL, updated REAL)')
+
+    def try_acquire(self, tokens: float = 1) -> float:
+        """Take the tokens if available and return 0, otherwise return
+        the number of seconds to wait before trying again.
+        """
+        with self._lock:
+            cursor = self._connection.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                now = time.time()
+                row = cursor.execute('SELECT tokens, updated FROM buckets WHERE name = ?',
+                                     (self._name,)).fetchone()
+                if row is None:
+                    available = self._capacity
+                else:
+                    available = min(self._capacity, row[0] + max(0, now - row[1]) * self._rate)
+                if available >= tokens:
+                    available -= tokens
+                    wait = 0
+                else:
+                    wait = (tokens - available) / self._rate
+                cursor.execute('INSERT OR REPLACE INTO buckets (name, tokens, updated) VALUES (?, ?, ?)',
+                               (self._name, available, now))
+                cursor.execute('COMMIT')
+            except BaseException:
+                cursor.execute('ROLLBACK')
+                raise
+            return wait
+
+    def close(self) -> None:
+        """Close the connection to the SQLite file."""
+        self._connection.close()
+
+
+class RateLimiter:
+    """Map API hosts to the buckets that limit them. Requests to
+    hosts without a bucket are not limited.
+
+    Example: RateLimiter({'api.ssactivewear.com': TokenBucket(1, 1)})
+    """
+    def __init__(self, buckets: {str: TokenBucket} = None):
+        self._buckets = dict(buckets or {})
+
+    @classmethod
+    def shared(cls, path: str, limits: {str: (float, float)}) -> 'RateLimiter':
+        """Return a RateLimiter whose buckets are stored in the SQLite file
+        at path, where limits is {host: (rate per second, capacity)}.
+        """
+        return cls({host: SQLiteTokenBucket(path, host, rate, capacity)
+                    for host, (rate, capacity) in limits.items()})
+
+    def set_bucket(self, host: str, bucket: TokenBucket) -> None:
+        """Limit requests to the given host with the given bucket."""
+        self._buckets[host] = bucket
+
+    def acquire(self, url: str) -> None:
+        """Block until a request to the host of the given URL is allowed."""
+        bucket = self._buckets.get(urllib.parse.urlsplit(url).hostname)
+        if bucket is not None:
+            bucket.acquire()
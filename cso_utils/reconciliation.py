@@ -0,0 +1,137 @@
+"""Reconcile ChannelAdvisor orders with S&S Activewear orders.
+
+ChannelAdvisor orders are streamed page by page, the matching
+S&S Activewear orders (same PO number) are fetched concurrently, and the
+lines of both are compared by sku. Discrepancies are yielded as soon as
+each order is compared, with at most "window" orders in memory at once.
+"""
+import collections
+import concurrent.futures
+
+import requests
+
+from . import channeladvisor
+from . import ssactivewear
+from . import stored_data
+
+MISSING_PO = 'missing_po'
+MISSING_SKU = 'missing_sku'
+UNEXPECTED_SKU = 'unexpected_sku'
+QTY_MISMATCH = 'qty_mismatch'
+UNSHIPPED = 'unshipped'
+ERROR = 'error'
+
+
+class Discrepancy(stored_data.StoredData):
+    def kind(self) -> 'missing_po' or 'missing_sku' or 'unexpected_sku' or 'qty_mismatch' or 'unshipped' or 'error':
+        """Return the kind of discrepancy."""
+        return self._data['kind']
+
+    def po_number(self) -> str:
+        """Return the PO number."""
+        return self._data['po_number']
+
+    def sku(self) -> str or None:
+        """Return the sku, or None if the discrepancy is about the whole order."""
+        return self._data.get('sku')
+
+    def ca_qty(self) -> int or None:
+        """Return the qty ordered on ChannelAdvisor."""
+        return self._data.get('ca_qty')
+
+    def ss_qty_ordered(self) -> int or None:
+        """Return the qty ordered from S&S Activewear."""
+        return self._data.get('ss_qty_ordered')
+
+    def ss_qty_shipped(self) -> int or None:
+        """Return the qty shipped by S&S Activewear."""
+        return self._data.get('ss_qty_shipped')
+
+    def error(self) -> str or None:
+        """Return the error raised while fetching the S&S Activewear order."""
+        return self._data.get('error')
+
+
+def reconcile_shipped_on(ca_api: channeladvisor.ChannelAdvisor,
+                         ss_api: ssactivewear.SSActivewear,
+                         month: int, day: int, year: int,
+                         window: int = 50, max_workers: int = 8) -> 'generator':
+    """Yield a Discrepancy for every difference between the ChannelAdvisor
+    orders shipped on the given date and their S&S Activewear orders.
+    """
+    return reconcile(ca_api.iter_orders_shipped_on(month, day, year), ss_api, window, max_workers)
+
+
+def reconcile(ca_orders: [channeladvisor.ChannelAdvisorOrder],
+              ss_api: ssactivewear.SSActivewear,
+              window: int = 50, max_workers: int = 8) -> 'generator':
+    """Yield a Discrepancy for every difference between the given
+    ChannelAdvisor orders (any iterable) and their S&S Activewear orders.
+    Up to "window" S&S Activewear orders are fetched ahead.
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = collections.deque()
+        for ca_order in ca_orders:
+            pending.append((ca_order, executor.submit(_fetch_order, ss_api, ca_order.po_number())))
+            if len(pending) >= window:
+                ca_order, future = pending.popleft()
+                yield from compare(ca_order, future.result())
+        while pending:
+            ca_order, future = pending.popleft()
+            yield from compare(ca_order, future.result())
+
+
+def _fetch_order(ss_api: ssactivewear.SSActivewear,
+                 po_number: str) -> ssactivewear.Order or None or Exception:
+    """Return the S&S Activewear order, None if it does not exist,
+    or the exception raised while fetching it.
+    """
+    try:
+        order = ss_api.get_order(po_number)
+    except requests.exceptions.HTTPError as e:
+        if e.response is not None and e.response.status_code == 404:
+            return None
+        return e
+    except Exception as e:
+        return e
+    return order if order.data() else None
+
+
+def compare(ca_order: channeladvisor.ChannelAdvisorOrder,
+            ss_order: ssactivewear.Order or None or Exception) -> [Discrepancy]:
+    """Return the discrepancies between a ChannelAdvisor order and
+    its S&S Activewear order.
+    """
+    po_number = ca_order.po_number()
+    if isinstance(ss_order, Exception):
+        return [Discrepancy({'kind': ERROR, 'po_number': po_number, 'error': repr(ss_order)})]
+    if ss_order is None:
+        return [Discrepancy({'kind': MISSING_PO, 'po_number': po_number})]
+
+    ca_qtys = dict()
+    for item in ca_order.data()['Items']:
+        ca_qtys[item['Sku']] = ca_qtys.get(item['Sku'], 0) + item['Quantity']
+    ss_qtys = dict()
+    for package in ss_order.data():
+        for line in package['lines']:
+            ordered, shipped = ss_qtys.get(line['sku'], (0, 0))
+            ss_qtys[line['sku']] = (ordered + line['qtyOrdered'], shipped + line.get('qtyShipped', 0))
+
+    discrepancies = []
+    for sku, ca_qty in ca_qtys.items():
+        if sku not in ss_qtys:
+            discrepancies.append(Discrepancy({'kind': MISSING_SKU, 'po_number': po_number,
+                                              'sku': sku, 'ca_qty': ca_qty}))
+            continue
+        ordered, shipped = ss_qtys[sku]
+        record = {'po_number': po_number, 'sku': sku, 'ca_qty': ca_qty,
+                  'ss_qty_ordered': ordered, 'ss_qty_shipped': shipped}
+        if ca_qty != ordered:
+            discrepancies.append(Discrepancy(dict(record, kind=QTY_MISMATCH)))
+        if shipped < ordered:
+            discrepancies.append(Discrepancy(dict(record, kind=UNSHIPPED)))
+    for sku, (ordered, shipped) in ss_qtys.items():
+        if sku not in ca_qtys:
+            discrepancies.append(Discrepancy({'kind': UNEXPECTED_SKU, 'po_number': po_number, 'sku': sku,
+                                              'ss_qty_ordered': ordered, 'ss_qty_shipped': shipped}))
+    return discrepancies
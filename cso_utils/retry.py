@@ -0,0 +1,205 @@
+"""Retry requests with jittered exponential backoff.
+
+A RetryPolicy retries idempotent requests that fail with a connection
+error or a retryable status code, honoring the Retry-After header.
+Every host also gets a CircuitBreaker so that calls fail fast while
+an API is down instead of waiting through every retry.
+"""
+import email.utils
+import random
+import threading
+import time
+import urllib.parse
+
+import requests
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised when a request is refused because the circuit for its host is open."""
+
+
+class CircuitBreaker:
+    """Track consecutive failures for a single host.
+
+    After "failure_threshold" consecutive failures the circuit opens and
+    requests are refused for "reset_timeout" seconds. The next request
+    after that is let through as a trial; success closes the circuit,
+    failure opens it again.
+    """
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def state(self) -> 'closed' or 'open' or 'half-open':
+        """Return the current state of the circuit."""
+        with self._lock:
+            return self._state()
+
+    def _state(self) -> str:
+        if self._opened_at is None:
+            return 'closed'
+        if time.monotonic() - self._opened_at >= self._reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow_request(self) -> bool:
+        """Return True if a request may be sent, False otherwise."""
+        with self._lock:
+            state = self._state()
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        """Close the circuit."""
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def release_trial(self) -> None:
+        """Let another request through as the trial, without counting
+        the current one as a success or a failure.
+        """
+        with self._lock:
+            self._trial_running = False
+
+    def record_failure(self) -> None:
+        """Count a failure and open the circuit if the threshold is reached."""
+        with self._lock:
+            self._failures += 1
+            self._trial_running = False
+            if self._opened_at is not None or self._failures >= self._failure_threshold:
+                self._opened_at = time.monotonic()
+
+
+class RetryPolicy:
+    """Decide when and how long to wait before retrying a request.
+
+    Args:
+        max_retries: Number of retries after the first attempt.
+        backoff_factor: Base delay in seconds; the n-th retry waits a random
+            time between 0 and backoff_factor * 2 ** n.
+        max_backoff: Upper bound for a single delay in seconds.
+        retry_statuses: Status codes that are retried.
+        idempotent_methods: Only requests with these methods are retried.
+        max_retry_after: Longest Retry-After (in seconds) that is honored.
+            Responses asking for a longer wait are returned as is.
+        failure_threshold: Consecutive failed requests that open a host's circuit.
+            A request counts once, after its last retry.
+        reset_timeout: Seconds a circuit stays open before a trial request.
+    """
+    def __init__(self, max_retries: int = 5, backoff_factor: float = 0.5,
+                 max_backoff: float = 60,
+                 retry_statuses: {int} = frozenset({429, 500, 502, 503, 504}),
+                 idempotent_methods: {str} = frozenset({'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}),
+                 max_retry_after: float = 300,
+                 failure_threshold: int = 5, reset_timeout: float = 30):
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.retry_statuses = frozenset(retry_statuses)
+        self.idempotent_methods = frozenset(method.upper() for method in idempotent_methods)
+        self.max_retry_after = max_retry_after
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._breakers = dict()
+        self._lock = threading.Lock()
+
+    def circuit_breaker(self, host: str) -> CircuitBreaker:
+        """Return the CircuitBreaker for the given host."""
+        with self._lock:
+            if host not in self._breakers:
+                self._breakers[host] = CircuitBreaker(self._failure_threshold,
+                                                      self._reset_timeout)
+            return self._breakers[host]
+
+    def backoff(self, attempt: int) -> float:
+        """Return the jittered delay in seconds before the given retry (starting at 0)."""
+        return random.uniform(0, min(self.max_backoff, self.backoff_factor * 2 ** attempt))
+
+    def send(self, send_once: 'callable', method: str, url: str, 
+             retryable: bool = None, **kwargs) -> requests.Response:
+        """Send a request with send_once(method, url, **kwargs), retrying
+        according to the policy. retryable overrides whether the method 
+        is treated as idempotent. Return the last response; raising for
+        its status is left to the caller.
+        """
+        method = method.upper()
+        breaker = self.circuit_breaker(urllib.parse.urlsplit(url).hostname)
+        if retryable is None:
+            retryable = method in self.idempotent_methods
+        if not breaker.allow_request():
+            raise CircuitOpenError(f'Circuit open for {urllib.parse.urlsplit(url).hostname}')
+        # the breaker counts requests, not attempts, and a request it let
+        # through is never refused while retrying
+        try:
+            response = self._send_with_retries(send_once, method, url, retryable, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            breaker.record_failure()
+            raise
+        except BaseException:
+            # not a failure of the host, but a trial must not stay running
+            breaker.release_trial()
+            raise
+        if response.status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        return response
+
+    def _send_with_retries(self, send_once: 'callable', method: str, url: str,
+                           retryable: bool, **kwargs) -> requests.Response:
+        """Send the request until it succeeds or is out of retries."""
+        attempt = 0
+        while True:
+            try:
+                response = send_once(method, url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if not retryable or attempt >= self.max_retries:
+                    raise
+                delay = self.backoff(attempt)
+            else:
+                if (not retryable
+                    or attempt >= self.max_retries
+                    or response.status_code not in self.retry_statuses):
+                    return response
+                retry_after = _retry_after(response)
+                if retry_after is None:
+                    delay = self.backoff(attempt)
+                elif retry_after > self.max_retry_after:
+                    return response
+                else:
+                    delay = retry_after
+            time.sleep(delay)
+            attempt += 1
+
+
+def _retry_after(response: requests.Response) -> float or None:
+    """Return the delay in seconds asked for by the Retry-After header,
+    or None if there is no usable header.
+    """
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at is None:
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+default_policy = RetryPolicy()
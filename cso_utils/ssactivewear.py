@@ -1,9 +1,13 @@
+import concurrent.futures
+import contextvars
 import datetime
 import unicodedata
 
-import requests
-from bs4 import BeautifulSoup
-
+from . import api_client
+from . import cassette as cassettes
+from . import instrumentation
+from . import rate_limit
+from . import retry
 from . import stored_data
 
 
@@ -106,6 +110,8 @@ class Style(stored_data.StoredData):
         """Return the description as a list of str 
         where each str is a bullet point.
         """
+        from bs4 import BeautifulSoup
+
         html_text = self._data['description'].split('<li>')
         parsed_text = []
         for html_line in html_text:
@@ -116,34 +122,55 @@ class Style(stored_data.StoredData):
         return parsed_text
 
 
-class SSActivewear:
-    def __init__(self, account: str, password: str):
+class SSActivewear(api_client.APIClient):
+    def __init__(self, account: str, password: str,
+                 retry_policy: retry.RetryPolicy = None,
+                 rate_limiter: rate_limit.RateLimiter = None,
+                 hooks: instrumentation.Instrumentation = None,
+                 cassette: cassettes.Cassette = None):
+        super().__init__(retry_policy, rate_limiter, hooks, cassette)
         self._auth = (account, password)
         self._endpoint = 'https://api.ssactivewear.com/v2/'
         self._headers = {'Content-Type': 'application/json'}
 
-    def get_order(self, po_number: str) -> Order:
+    @api_client.operation
+    def get_order(self, po_number: str, fields: [str] = None) -> Order:
         """Return an order object representing the order with 
         the given PO number. Ignore returns and cancellations.
+        Only the given fields are requested if fields is given.
         """
-        return self._get_order_using(po_number)
+        return self._get_order_using(po_number, fields=fields)
 
-    def get_invoice(self, invoice: str) -> Order:
+    @api_client.operation
+    def get_invoice(self, invoice: str, fields: [str] = None) -> Order:
         """Return an Order object representing the given invoice. 
         Ignore returns and cancellations.
+        Only the given fields are requested if fields is given.
         """ 
-        return self._get_order_using(invoice, 'invoice')
+        return self._get_order_using(invoice, 'invoice', fields)
 
     def _get_order_using(self, po_number_or_invoice: str, 
-                         num_type: 'po' or 'invoice' = 'po') -> Order:
+                         num_type: 'po' or 'invoice' = 'po',
+                         fields: [str] = None) -> Order:
         """Return an Order object representing the order with 
         the given PO number or invoice. Ignore returns and cancellations.
         """
-        response = requests.get(self._endpoint + 'orders/' + po_number_or_invoice + '?lines=true',
-                                auth=self._auth,
-                                headers=self._headers)
+        filter_fields = ['poNumber', 'invoiceNumber', 'orderType', 'orderStatus']
+        query = '?lines=true' + self._fields_query(fields, filter_fields, '&')
+        response = self._request('GET', self._endpoint + 'orders/' + po_number_or_invoice + query,
+                                 auth=self._auth,
+                                 headers=self._headers)
         response.raise_for_status()
-        return Order(self._filter(po_number_or_invoice, response.json(), num_type))
+        return Order(self._filter(po_number_or_invoice, self._json(response), num_type))
+
+    def _fields_query(self, fields: [str] or None, required: [str], separator: str = '?') -> str:
+        """Return the query string that limits the response to the given 
+        fields plus the required ones, or '' if fields is None.
+        """
+        if fields is None:
+            return ''
+        fields = list(required) + [field for field in fields if field not in required]
+        return separator + 'fields=' + ','.join(fields)
 
     def _filter(self, po_number_or_invoice: str, response: [dict], 
                 num_type: 'po' or 'invoice' = 'po') -> [dict]:
@@ -162,6 +189,7 @@ class SSActivewear:
                 data.append(package)
         return data
 
+    @api_client.operation
     def full_return(self, po_number: str, reason_code: int, 
                     reason_comment: str, test: bool, 
                     return_warehouses: [str] = None, 
@@ -175,6 +203,7 @@ class SSActivewear:
                                        return_warehouses, 
                                        force_restock)
 
+    @api_client.operation
     def invoice_return(self, invoice: str, reason_code: int, 
                        reason_comment: str, test: bool, 
                        return_warehouses: [str] = None, 
@@ -204,6 +233,7 @@ class SSActivewear:
                                        force_restock)
         return ra_info
 
+    @api_client.operation
     def partial_return(self, po_number: str, 
                        skus_and_qtys: {str: int}, 
                        reason_code: int,
@@ -220,6 +250,57 @@ class SSActivewear:
                                        force_restock)
         return ra_info
 
+    @api_client.operation
+    def batch_return(self, returns: {str: {str: int} or None},
+                     reason_code: int,
+                     reason_comment: str,
+                     test: bool,
+                     return_warehouses: [str] = None,
+                     force_restock: bool = False,
+                     max_workers: int = 8,
+                     requests_per_second: float = 1) -> {str: ReturnRequest or Exception}:
+        """Request returns for many PO numbers concurrently. returns maps each 
+        PO number to the skus and qtys to return, or None for a full return.
+        The order lookups and return requests of the batch are limited to 
+        requests_per_second (None for no limit besides the client's RateLimiter),
+        since a return request that gets a 429 is not retried.
+        Returns {PO number: ReturnRequest, or the exception raised for that PO}.
+        """
+        bucket = rate_limit.TokenBucket(requests_per_second) if requests_per_second else None
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {po_number: executor.submit(contextvars.copy_context().run,
+                                                  self._batch_return_one,
+                                                  po_number, skus_and_qtys, reason_code,
+                                                  reason_comment, test, return_warehouses,
+                                                  force_restock, bucket)
+                       for po_number, skus_and_qtys in returns.items()}
+            results = dict()
+            for po_number, future in futures.items():
+                try:
+                    results[po_number] = future.result()
+                except Exception as e:
+                    results[po_number] = e
+        return results
+
+    def _batch_return_one(self, po_number: str, skus_and_qtys: {str: int} or None,
+                          reason_code: int, reason_comment: str, test: bool,
+                          return_warehouses: [str] or None, force_restock: bool,
+                          bucket: rate_limit.TokenBucket or None) -> ReturnRequest:
+        """Request a full or partial return for one PO of a batch, taking a
+        token from the bucket before each request.
+        """
+        if bucket is not None:
+            bucket.acquire()
+        original_order = self._get_order_using(po_number)
+        if skus_and_qtys is None:
+            lines_to_return = original_order.lines()
+        else:
+            lines_to_return = self._match_skus_with_invoice(original_order.lines(), skus_and_qtys)
+        if bucket is not None:
+            bucket.acquire()
+        return self._return_request(lines_to_return, reason_code, reason_comment,
+                                    test, return_warehouses, force_restock)
+
     def _return_request(self, lines_to_return: [{'invoice': str, 'sku': str, 'qty_shipped': int}],
                         reason_code: int, reason_comment: str, test: bool,
                         return_warehouses: [str] or None, force_restock: bool) -> ReturnRequest:
@@ -242,11 +323,11 @@ class SSActivewear:
                 'ForceRestock': force_restock}
         if return_warehouses:
             data['returnToWareHouses'] = ','.join(return_warehouses)
-        response = requests.post(self._endpoint + 'returns/',
+        response = self._request('POST', self._endpoint + 'returns/',
                                  auth=self._auth,
                                  json=data)
         response.raise_for_status()
-        return ReturnRequest(response.json())
+        return ReturnRequest(self._json(response))
 
     def _match_skus_with_invoice(self,
                                  original_lines: [{'invoice': str, 'sku': str, 'qty_shipped': int}],
@@ -254,30 +335,39 @@ class SSActivewear:
         """Match skus with invoices from original order. Return [dict] where each dict 
         has invoice, sku, and qty_shipped.
         """
-        lines_with_invoice = []
-        for original_line in original_lines:
-            sku = original_line['sku']
-            if sku in skus_and_qtys and original_line['qty_shipped'] >= skus_and_qtys[sku]:
-                lines_with_invoice.append({'invoice': original_line['invoice'],
-                                           'sku': sku,
-                                           'qty_shipped': skus_and_qtys[sku]})
-                del skus_and_qtys[sku]
-        if len(skus_and_qtys) != 0:
-            raise ValueError('sku or qty not in original order')
-        return lines_with_invoice
-
+        lines_by_sku = dict()
+        for position, original_line in enumerate(original_lines):
+            lines_by_sku.setdefault(original_line['sku'], []).append((position, original_line))
+
+        matched = []
+        for sku, qty in skus_and_qtys.items():
+            for position, original_line in lines_by_sku.get(sku, []):
+                if original_line['qty_shipped'] >= qty:
+                    matched.append((position, {'invoice': original_line['invoice'],
+                                               'sku': sku,
+                                               'qty_shipped': qty}))
+                    break
+            else:
+                raise ValueError('sku or qty not in original order')
+        matched.sort(key=lambda item: item[0])
+        return [line for position, line in matched]
+
+    @api_client.operation
     def track_using_invoices(self, nums: [str]) -> Tracking:
         """Return Tracking for the given invoices."""
         return self._track_using('Invoice', nums)
 
+    @api_client.operation
     def track_using_tracking(self, nums: [str]) -> Tracking:
         """Return Tracking for the given tracking numbers."""
         return self._track_using('TrackingNum', nums)
 
+    @api_client.operation
     def track_using_order_nums(self, nums: [str]) -> Tracking:
         """Return Tracking for the given order numbers."""
         return self._track_using('OrderNum', nums)
 
+    @api_client.operation
     def track_using_actual_delivery_dates(self, dates: [datetime.datetime]) -> Tracking:
         """Return Tracking for orders delivered on the given dates."""
         formatted_dates = []
@@ -289,56 +379,63 @@ class SSActivewear:
         """Return Tracking for the given data_type."""
         url = self._endpoint + 'TrackingDataBy' + \
               data_type + '/' + ','.join(list_of_numbers)
-        response = requests.get(url, auth=self._auth, headers=self._headers)
+        response = self._request('GET', url, auth=self._auth, headers=self._headers)
         response.raise_for_status()
-        return Tracking(response.json())
+        return Tracking(self._json(response))
 
+    @api_client.operation
     def get_product(self, sku: str) -> Product:
         """Return Product for the given sku."""
-        response = requests.get(self._endpoint + 'products/' + sku,
-                                auth=self._auth,
-                                headers=self._headers)
+        response = self._request('GET', self._endpoint + 'products/' + sku,
+                                 auth=self._auth,
+                                 headers=self._headers)
         response.raise_for_status()
-        return Product(response.json()[0])
+        return Product(self._json(response)[0])
         
-    def get_products(self) -> {str: Product}:
+    @api_client.operation
+    def get_products(self, fields: [str] = None) -> {str: Product}:
         """Return all products as Product objects stored in a dict 
-        with the keys being the skus.
+        with the keys being the skus. Only the given fields (and sku) 
+        are requested if fields is given.
         """
-        response = requests.get(self._endpoint + 'products/',
-                                auth=self._auth,
-                                headers=self._headers)
+        response = self._request('GET', self._endpoint + 'products/' + self._fields_query(fields, ['sku']),
+                                 auth=self._auth,
+                                 headers=self._headers)
         response.raise_for_status()
         products = dict()
-        for product in response.json():
+        for product in self._json(response):
             products[product['sku']] = Product(product)
         return products
 
+    @api_client.operation
     def get_products_with_style_id(self, style_id: int) -> [Product]:
         """Return all products with the given style ID."""
-        response = requests.get(self._endpoint + 'products/?styleid=' + str(style_id), 
-                                auth=self._auth,
-                                headers=self._headers)
+        response = self._request('GET', self._endpoint + 'products/?styleid=' + str(style_id), 
+                                 auth=self._auth,
+                                 headers=self._headers)
         response.raise_for_status()
-        return [Product(product) for product in response.json()]
+        return [Product(product) for product in self._json(response)]
 
+    @api_client.operation
     def get_style(self, style_id: int) -> Style:
         """Return Style for the given style ID."""
-        response = requests.get(self._endpoint + 'styles/' + str(style_id),
-                                auth=self._auth,
-                                headers=self._headers)
+        response = self._request('GET', self._endpoint + 'styles/' + str(style_id),
+                                 auth=self._auth,
+                                 headers=self._headers)
         response.raise_for_status()
-        return Style(response.json()[0])
+        return Style(self._json(response)[0])
 
-    def get_styles(self) -> {int: Style}:
+    @api_client.operation
+    def get_styles(self, fields: [str] = None) -> {int: Style}:
         """Return all styles as Style objects stored in a dict 
-        with the keys being style IDs.
+        with the keys being style IDs. Only the given fields (and styleID) 
+        are requested if fields is given.
         """
-        response = requests.get(self._endpoint + 'styles/',
-                                auth=self._auth,
-                                headers=self._headers)
+        response = self._request('GET', self._endpoint + 'styles/' + self._fields_query(fields, ['styleID']),
+                                 auth=self._auth,
+                                 headers=self._headers)
         response.raise_for_status()
         styles = dict()
-        for style in response.json():
+        for style in self._json(response):
             styles[style['styleID']] = Style(style)
         return styles
\ No newline at end of file
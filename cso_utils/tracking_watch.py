@@ -0,0 +1,116 @@
+"""Poll S&S Activewear tracking and report only status changes.
+
+A TrackingWatcher keeps the last status of every watched tracking number
+in a local SQLite file. Each poll requests only the numbers that are due,
+in batches, and yields the ones whose status changed. Numbers that
+changed recently are polled again after "active_interval"; each unchanged
+poll doubles the wait up to "max_interval", packages without a change for
+"stale_after" wait "max_interval", and delivered packages (with an actual
+delivery date or a latest checkpoint of exactly "Delivered") are no
+longer polled.
+"""
+import sqlite3
+import threading
+import time
+
+from . import ssactivewear
+
+
+class TrackingWatcher:
+    def __init__(self, ss_api: ssactivewear.SSActivewear, path: str,
+                 batch_size: int = 50,
+                 active_interval: float = 3600,
+                 max_interval: float = 86400,
+                 stale_after: float = 14 * 86400):
+        self._ss_api = ss_api
+        self._batch_size = batch_size
+        self._active_interval = active_interval
+        self._max_interval = max_interval
+        self._stale_after = stale_after
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute('CREATE TABLE IF NOT EXISTS tracking '
+                                     '(number TEXT PRIMARY KEY, status TEXT, changed_at REAL, '
+                                     'next_poll REAL, interval REAL, delivered INTEGER)')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS due ON tracking (delivered, next_poll)')
+
+    def close(self) -> None:
+        """Close the store."""
+        self._connection.close()
+
+    def watch(self, tracking_nums: [str], now: float = None) -> None:
+        """Start watching the given tracking numbers. They are due at once."""
+        now = time.time() if now is None else now
+        with self._lock, self._connection:
+            self._connection.executemany('INSERT OR IGNORE INTO tracking VALUES (?, NULL, ?, ?, ?, 0)',
+                                         [(num, now, now, self._active_interval) for num in tracking_nums])
+
+    def unwatch(self, tracking_nums: [str]) -> None:
+        """Stop watching the given tracking numbers."""
+        with self._lock, self._connection:
+            self._connection.executemany('DELETE FROM tracking WHERE number = ?',
+                                         [(num,) for num in tracking_nums])
+
+    def status(self, tracking_num: str) -> str or None:
+        """Return the last known status of the tracking number."""
+        with self._lock:
+            row = self._connection.execute('SELECT status FROM tracking WHERE number = ?',
+                                           (tracking_num,)).fetchone()
+        return row[0] if row else None
+
+    def due(self, now: float = None) -> [str]:
+        """Return the tracking numbers that are due to be polled."""
+        now = time.time() if now is None else now
+        with self._lock:
+            rows = self._connection.execute('SELECT number FROM tracking WHERE delivered = 0 AND next_poll <= ? '
+                                            'ORDER BY next_poll', (now,)).fetchall()
+        return [row[0] for row in rows]
+
+    def poll(self, now: float = None) -> 'generator':
+        """Request tracking for the numbers that are due and yield
+        (tracking number, latest checkpoint status) for each one that changed.
+        """
+        now = time.time() if now is None else now
+        due = self.due(now)
+        for start in range(0, len(due), self._batch_size):
+            batch = due[start:start + self._batch_size]
+            tracking = self._ss_api.track_using_tracking(batch)
+            statuses = dict(tracking.num_and_status())
+            delivered = {package['trackingNumber'] for package in tracking.data() if _is_delivered(package)}
+            yield from self._update(batch, statuses, delivered, now)
+
+    def _update(self, batch: [str], statuses: {str: str}, delivered: {str}, 
+                now: float) -> [(str, str)]:
+        """Store the polled statuses, reschedule the batch and return the changes."""
+        changed = []
+        with self._lock, self._connection:
+            rows = self._connection.execute(
+                f'SELECT number, status, changed_at, interval FROM tracking '
+                f'WHERE number IN ({",".join("?" * len(batch))})', batch).fetchall()
+            for number, old_status, changed_at, interval in rows:
+                status = statuses.get(number)
+                if status is not None and status != old_status:
+                    changed.append((number, status))
+                    changed_at = now
+                    interval = self._active_interval
+                elif now - changed_at >= self._stale_after:
+                    interval = self._max_interval
+                else:
+                    interval = min(interval * 2, self._max_interval)
+                status = old_status if status is None else status
+                self._connection.execute('UPDATE tracking SET status = ?, changed_at = ?, next_poll = ?, '
+                                         'interval = ?, delivered = ? WHERE number = ?',
+                                         (status, changed_at, now + interval, interval, 
+                                          int(number in delivered), number))
+        return changed
+
+
+def _is_delivered(package: dict) -> bool:
+    """Return True if the tracking data of the package shows it was delivered.
+    Messages such as "Not Delivered" or "Undelivered" do not count.
+    """
+    if package.get('actualDeliveryDate'):
+        return True
+    message = package['latestCheckpoint']['checkpointStatusMessage'] or ''
+    return message.strip().lower() == 'delivered'
@@ -1,8 +1,17 @@
+import concurrent.futures
+import contextvars
 import datetime
+import threading
 import time
 import warnings
+
 import requests
 
+from . import api_client
+from . import cassette as cassettes
+from . import instrumentation
+from . import rate_limit
+from . import retry
 from . import stored_data
 
 class Ticket(stored_data.StoredData):
@@ -14,6 +23,10 @@ class Ticket(stored_data.StoredData):
         """Return the ticket's subject."""
         return self._data['subject']
 
+    def creation_datetime(self) -> datetime.datetime:
+        """Return the date and time (UTC) the ticket was created."""
+        return datetime.datetime.strptime(self._data['created_at'][:19], '%Y-%m-%dT%H:%M:%S')
+
     def custom_fields(self) -> dict:
         """Return the custom fields as a dict."""
         all_custom_fields = dict()
@@ -50,21 +63,255 @@ class Ticket(stored_data.StoredData):
         return (self._data['via']['channel'] == 'email' 
                 and self._data['via']['source']['from']['address'] == email)
 
-class Zendesk:
+    def updated_at(self) -> str:
+        """Return when the ticket was last updated, as given by Zendesk."""
+        return self._data['updated_at']
+
+
+class TicketBundle(stored_data.StoredData):
+    """Tickets with their side-loaded users, groups and organizations."""
+    def tickets(self) -> [Ticket]:
+        """Return the tickets."""
+        return [Ticket(ticket) for ticket in self._data['tickets']]
+
+    def ticket(self, id_number: int or str) -> Ticket:
+        """Return the ticket with the given ID. Raise KeyError if it is not in the bundle."""
+        for ticket in self._data['tickets']:
+            if str(ticket['id']) == str(id_number):
+                return Ticket(ticket)
+        raise KeyError(id_number)
+
+    def requester(self, ticket: Ticket) -> dict or None:
+        """Return the side-loaded user who requested the ticket."""
+        return self._related('users', ticket.data().get('requester_id'))
+
+    def assignee(self, ticket: Ticket) -> dict or None:
+        """Return the side-loaded user the ticket is assigned to."""
+        return self._related('users', ticket.data().get('assignee_id'))
+
+    def group(self, ticket: Ticket) -> dict or None:
+        """Return the side-loaded group of the ticket."""
+        return self._related('groups', ticket.data().get('group_id'))
+
+    def organization(self, ticket: Ticket) -> dict or None:
+        """Return the side-loaded organization of the ticket."""
+        return self._related('organizations', ticket.data().get('organization_id'))
+
+    def _related(self, kind: str, id_number: int or None) -> dict or None:
+        if id_number is None:
+            return None
+        for item in self._data.get(kind, []):
+            if item['id'] == id_number:
+                return item
+        return None
+
+
+class TicketCache:
+    """Keep tickets and their side-loaded objects by ticket ID.
+
+    Before serving cached tickets, a client using the cache asks the
+    incremental ticket export which tickets were updated since its last
+    check, at most once every "revalidate_after" seconds, and drops their
+    entries. If the check fails (the export needs an admin token and
+    allows about 10 requests a minute), no entry is served until a later
+    check succeeds. Entries older than "max_age" seconds are requested
+    again in any case. update_from() drops entries that other ticket
+    listings show to be out of date.
+    """
+    def __init__(self, max_age: float = 3600, revalidate_after: float = 60):
+        self._max_age = max_age
+        self._revalidate_after = revalidate_after
+        self._entries = dict()
+        self._cursor = None
+        self._started_at = None
+        self._checked_at = None
+        self._valid = False
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, id_number: int or str) -> dict or None:
+        """Return the fresh entry {'ticket', 'users', 'groups', 'organizations'}
+        for the ticket, or None. Nothing is served while the last check
+        against the incremental ticket export has failed.
+        """
+        with self._lock:
+            entry = self._entries.get(str(id_number))
+            if entry is None or not self._valid:
+                return None
+            if self._max_age is not None and time.monotonic() - entry['cached_at'] >= self._max_age:
+                return None
+            return entry
+
+    def put(self, ticket: dict, users: [dict], groups: [dict], organizations: [dict]) -> None:
+        """Store the ticket with its related objects."""
+        with self._lock:
+            if self._started_at is None:
+                self._started_at = time.time()
+            self._entries[str(ticket['id'])] = {'ticket': ticket, 
+                                                'users': users, 
+                                                'groups': groups, 
+                                                'organizations': organizations,
+                                                'cached_at': time.monotonic()}
+
+    def update_from(self, tickets: [Ticket]) -> None:
+        """Drop the entries of the given tickets whose updated_at has changed."""
+        with self._lock:
+            for ticket in tickets:
+                entry = self._entries.get(str(ticket.id_num()))
+                if entry is not None and entry['ticket'].get('updated_at') != ticket.updated_at():
+                    del self._entries[str(ticket.id_num())]
+
+    def invalidate(self, id_number: int or str) -> None:
+        """Drop the entry of the given ticket."""
+        with self._lock:
+            self._entries.pop(str(id_number), None)
+
+    def needs_revalidation(self) -> bool:
+        """Return True if entries must be checked against the incremental
+        ticket export before they are served.
+        """
+        with self._lock:
+            return bool(self._entries) and (self._checked_at is None
+                                            or time.monotonic() - self._checked_at >= self._revalidate_after)
+
+    def export_position(self) -> (str or None, int):
+        """Return (cursor, start time) for the next incremental ticket export.
+        Without a cursor the export starts a minute before the first entry
+        was cached, since Zendesk refuses more recent start times.
+        """
+        with self._lock:
+            started_at = self._started_at if self._started_at is not None else time.time()
+            return self._cursor, int(min(started_at, time.time() - 60))
+
+    def revalidated(self, cursor: str, checked_at: float) -> None:
+        """Remember where the incremental ticket export ended and when
+        (time.monotonic()) the check started.
+        """
+        with self._lock:
+            self._cursor = cursor
+            self._checked_at = checked_at
+            self._valid = True
+
+    def revalidation_failed(self, checked_at: float) -> None:
+        """Stop serving entries until the incremental ticket export can be
+        checked again, "revalidate_after" seconds after checked_at.
+        """
+        with self._lock:
+            self._checked_at = checked_at
+            self._valid = False
+
+
+class Zendesk(api_client.APIClient):
     """Used to interact with the Zendesk Tickets API.
     https://developer.zendesk.com/api-reference/ticketing/tickets/tickets/
     """
-    def __init__(self, subdomain: str, email: str, token: str):
+    def __init__(self, subdomain: str, email: str, token: str,
+                 retry_policy: retry.RetryPolicy = None,
+                 rate_limiter: rate_limit.RateLimiter = None,
+                 hooks: instrumentation.Instrumentation = None,
+                 cassette: cassettes.Cassette = None,
+                 ticket_cache: TicketCache = None):
+        super().__init__(retry_policy, rate_limiter, hooks, cassette)
+        self._ticket_cache = ticket_cache
         self._subdomain = subdomain
         self._auth = (email + '/token', token)
         self._url = f'https://{self._subdomain}.zendesk.com/api/v2/tickets'
 
+    @api_client.operation
     def get_ticket(self, id_number: str) -> Ticket:
         """Return a Ticket with the given id."""
-        response = requests.get(self._url + '/' + id_number, auth=self._auth)
+        if self._ticket_cache is None:
+            response = self._request('GET', self._url + '/' + id_number, auth=self._auth)
+            response.raise_for_status()
+            return Ticket(self._json(response)['ticket'])
+
+        self._revalidate_cache()
+        entry = self._ticket_cache.get(id_number)
+        if entry is not None:
+            return Ticket(entry['ticket'])
+        response = self._request('GET', self._url + '/' + id_number + '?include=users,groups,organizations', 
+                                 auth=self._auth)
         response.raise_for_status()
-        return Ticket(response.json()['ticket'])
+        data = self._json(response)
+        self._cache_tickets(dict(data, tickets=[data['ticket']]))
+        return Ticket(data['ticket'])
 
+    @api_client.operation
+    def get_tickets(self, id_numbers: [str], 
+                    include: [str] = ('users', 'groups', 'organizations')) -> TicketBundle:
+        """Return a TicketBundle with the given tickets and their side-loaded 
+        users, groups and organizations, fetched with one request per 100 tickets. 
+        If the client has a TicketCache, cached tickets are not requested again.
+        """
+        if self._ticket_cache is not None:
+            self._revalidate_cache()
+        bundle = {'tickets': {}, 'users': {}, 'groups': {}, 'organizations': {}}
+        missing = []
+        for id_number in id_numbers:
+            entry = self._ticket_cache.get(id_number) if self._ticket_cache is not None else None
+            if entry is None:
+                missing.append(str(id_number))
+                continue
+            bundle['tickets'][entry['ticket']['id']] = entry['ticket']
+            for kind in ('users', 'groups', 'organizations'):
+                bundle[kind].update((item['id'], item) for item in entry[kind])
+
+        for start in range(0, len(missing), 100):
+            url = (self._url + '/show_many.json?ids=' + ','.join(missing[start:start + 100]) 
+                   + '&include=' + ','.join(include))
+            response = self._request('GET', url, auth=self._auth)
+            response.raise_for_status()
+            data = self._json(response)
+            for kind in bundle:
+                bundle[kind].update((item['id'], item) for item in data.get(kind, []))
+            if self._ticket_cache is not None:
+                self._cache_tickets(data)
+        return TicketBundle({kind: list(items.values()) for kind, items in bundle.items()})
+
+    def _revalidate_cache(self) -> None:
+        """Drop the cached tickets that the incremental ticket export shows
+        to have been updated since the last check. If the export cannot be
+        read, the cache is bypassed and tickets are requested as without it.
+        """
+        cache = self._ticket_cache
+        if not cache.needs_revalidation():
+            return
+        checked_at = time.monotonic()
+        cursor, start_time = cache.export_position()
+        url = self._url.rsplit('/', 1)[0] + '/incremental/tickets/cursor.json'
+        url += f'?cursor={cursor}' if cursor else f'?start_time={start_time}'
+        try:
+            while True:
+                # not retried: a 403 (agent token) or 429 (10 requests a minute)
+                # should bypass the cache, not wait for Retry-After
+                response = self._request('GET', url, auth=self._auth, retryable=False)
+                response.raise_for_status()
+                data = self._json(response)
+                cache.update_from(Ticket(ticket) for ticket in data['tickets'])
+                if data.get('end_of_stream', True):
+                    break
+                url = data['after_url']
+        except requests.exceptions.RequestException:
+            cache.revalidation_failed(checked_at)
+            return
+        cache.revalidated(data.get('after_cursor') or cursor, checked_at)
+
+    def _cache_tickets(self, data: dict) -> None:
+        """Store each ticket of a show_many response with the objects it refers to."""
+        users = {user['id']: user for user in data.get('users', [])}
+        groups = {group['id']: group for group in data.get('groups', [])}
+        organizations = {organization['id']: organization for organization in data.get('organizations', [])}
+        for ticket in data['tickets']:
+            user_ids = {ticket.get('requester_id'), ticket.get('assignee_id'), ticket.get('submitter_id')}
+            self._ticket_cache.put(ticket,
+                                   [users[user_id] for user_id in user_ids if user_id in users],
+                                   [groups[ticket['group_id']]] if ticket.get('group_id') in groups else [],
+                                   [organizations[ticket['organization_id']]] 
+                                   if ticket.get('organization_id') in organizations else [])
+
+    @api_client.operation
     def create_ticket_and_send_to_customer(self, customer_name: str, 
                                            customer_email: str, subject: str, 
                                            html_message: str, group_id: int = None,
@@ -82,6 +329,7 @@ class Zendesk:
         ticket_id = self.send_to_customer(ticket_id, html_message, group_id, tag)
         return ticket_id
 
+    @api_client.operation
     def create_ticket(self, customer_name: str, customer_email: str, subject: str, 
                       html_message: str, assignee_email: str = None, 
                       assignee_id: int = None,
@@ -135,11 +383,12 @@ class Zendesk:
                            'type': ticket_type, 
                            'via': {'channel': via_channel},
                            'due_at': due_at}}
-        response = requests.post(self._url, auth=self._auth, json=data)
+        response = self._request('POST', self._url, auth=self._auth, json=data)
         response.raise_for_status()
-        ticket_id = str(response.json()['ticket']['id'])
+        ticket_id = str(self._json(response)['ticket']['id'])
         return ticket_id
 
+    @api_client.operation
     def send_to_customer(self, ticket_id: str, html_message: str, 
                          group_id: int = None, tag: str or [str] = None) -> str:
         """Send a message to the customer by replying to the given ticket. 
@@ -147,6 +396,7 @@ class Zendesk:
         """
         return self.reply_to(ticket_id, html_message, group_id, tag)
 
+    @api_client.operation
     def reply_to(self, 
                  ticket_id: str, 
                  html_message: str, 
@@ -184,36 +434,75 @@ class Zendesk:
             custom_fields = [{"id": key, "value": value} for key, value in custom_fields.items()]
             data["ticket"]["custom_fields"] = custom_fields
 
-        response = requests.put(self._url + '/' + ticket_id, auth=self._auth, json=data)
+        # every PUT adds the comment again, so a reply is never retried
+        response = self._request('PUT', self._url + '/' + ticket_id, auth=self._auth, json=data, 
+                                 retryable=False)
         response.raise_for_status()
+        if self._ticket_cache is not None:
+            self._ticket_cache.invalidate(ticket_id)
 
         if tag:
             if type(tag) == str:
                 tag = [tag]
-            response = requests.put(self._url + '/' + ticket_id + '/tags', 
-                                    auth=self._auth, 
-                                    json={'tags': tag})
+            response = self._request('PUT', self._url + '/' + ticket_id + '/tags', 
+                                     auth=self._auth, 
+                                     json={'tags': tag})
             response.raise_for_status()
 
         return ticket_id
 
 
+    @api_client.operation
     def tickets_created_between_today_and(self, month: int, day: int, year: int) -> [Ticket]:
         """Return a list of Ticket objects representing tickets created during the 
         given times.
         """
-        json_tickets = []
-        url = self._url + '?page[size]=100&sort=-id'
-        start_day = datetime.datetime(year, month, day)
-        while True:
-            response = requests.get(url, auth=self._auth)
-            response.raise_for_status()
-            response = response.json()
-            current = datetime.datetime.strptime(response['tickets'][0]['created_at'].split('T')[0], '%Y-%m-%d')
-            if current < start_day:
-                break
-            json_tickets.extend(response['tickets'])
-            url = response['links']['next']
-            time.sleep(1)
-
-        return [Ticket(ticket) for ticket in json_tickets]
+        return list(self.iter_tickets(since=datetime.datetime(year, month, day)))
+
+    @api_client.operation
+    def iter_tickets(self, since: datetime.datetime or datetime.date, 
+                     until: datetime.datetime or datetime.date = None, 
+                     page_size: int = 100) -> 'generator':
+        """Yield Ticket objects, newest first, for tickets created at or after 
+        "since" and before "until" (UTC, or converted to UTC if timezone-aware). 
+        The next page is fetched in the background while the current one 
+        is consumed.
+        """
+        since = _as_datetime(since)
+        until = _as_datetime(until) if until is not None else None
+        url = self._url + f'?page[size]={page_size}&sort=-id'
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+            page = executor.submit(contextvars.copy_context().run, self._get_page, url)
+            while page is not None:
+                data = page.result()
+                tickets = data['tickets']
+                page = None
+                next_url = data.get('links', {}).get('next')
+                has_more = data.get('meta', {}).get('has_more', bool(next_url))
+                if (tickets and next_url and has_more
+                    and Ticket(tickets[-1]).creation_datetime() >= since):
+                    page = executor.submit(contextvars.copy_context().run, self._get_page, next_url)
+                for ticket in tickets:
+                    ticket = Ticket(ticket)
+                    created = ticket.creation_datetime()
+                    if created < since:
+                        if page is not None:
+                            page.cancel()
+                        return
+                    if until is None or created < until:
+                        yield ticket
+
+    def _get_page(self, url: str) -> dict:
+        """Return the decoded page of tickets at the given URL."""
+        response = self._request('GET', url, auth=self._auth)
+        response.raise_for_status()
+        return self._json(response)
+
+
+def _as_datetime(date: datetime.datetime or datetime.date) -> datetime.datetime:
+    """Return the date as a datetime at midnight, or the datetime as naive UTC."""
+    if isinstance(date, datetime.datetime):
+        if date.tzinfo is not None:
+            return date.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        return date
+    return datetime.datetime(date.year, date.month, date.day)
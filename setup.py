@@ -18,5 +18,6 @@ setup(name=package['__title__'],
                         package['__pygithub__'], 
                         package['__pytest__'], 
                         package['__pymysql__'],
-                        package['__beautifulsoup__']]
+                        package['__beautifulsoup__']],
+      extras_require={'pricing': [package['__numpy__']]}
 )
\ No newline at end of file
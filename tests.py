@@ -1,8 +1,14 @@
 import datetime
+import gzip
+import json
+import subprocess
+import sys
 
 import pytest
+import requests
 
-from cso_utils import ssactivewear, channeladvisor, zendesk
+from cso_utils import ssactivewear, channeladvisor, zendesk, retry, rate_limit
+from cso_utils import api_client, instrumentation, cassette, pricing, reconciliation, tracking_watch, catalog_snapshot, columnar
 
 class TestOrder:
     def test_repr(self):
@@ -153,6 +159,55 @@ class TestSSActivewear:
         all_of_order = {'2': 11, '3': 12, '4': 13, '5': 14, 
                         '6': 15, '7': 16, '8': 17, '9': 18}
         assert ssapi._match_skus_with_invoice(original_lines, all_of_order) == original_lines
+        assert len(all_of_order) == 8
+
+    def test_match_skus_with_invoice_repeated_sku(self):
+        original_lines = [{'invoice': '0', 'sku': '2', 'qty_shipped': 1}, 
+                          {'invoice': '1', 'sku': '2', 'qty_shipped': 5}]
+        ssapi = ssactivewear.SSActivewear('test', 'test')
+        assert (ssapi._match_skus_with_invoice(original_lines, {'2': 3}) == 
+                [{'invoice': '1', 'sku': '2', 'qty_shipped': 3}])
+
+    def test_batch_return(self, monkeypatch):
+        def request(method, url, **kwargs):
+            if method == 'GET':
+                po_number = url.split('/')[-1].split('?')[0]
+                if po_number == 'missing':
+                    return FakeResponse(404)
+                return FakeResponse(200, body=[{'poNumber': po_number, 'invoiceNumber': 'I' + po_number,
+                                                'orderType': 'Order', 'orderStatus': 'Shipped',
+                                                'lines': [{'sku': 'B0', 'qtyOrdered': 2, 'qtyShipped': 2}, 
+                                                          {'sku': 'B1', 'qtyOrdered': 1, 'qtyShipped': 1}]}])
+            lines = kwargs['json']['lines']
+            return FakeResponse(200, body=[{'returnInformation': {'raNumber': lines[0]['invoiceNumber'] + str(len(lines)),
+                                                                  'returnToAddress': {}}}])
+        monkeypatch.setattr(api_client.requests, 'request', request)
+        rates = []
+        monkeypatch.setattr(rate_limit.TokenBucket, 'acquire', lambda bucket: rates.append(bucket._rate))
+        ssapi = ssactivewear.SSActivewear('test', 'test', retry_policy=retry.RetryPolicy())
+        skus_and_qtys = {'B0': 1}
+        results = ssapi.batch_return({'1': None, '2': skus_and_qtys, '3': {'B2': 1}, 'missing': None}, 
+                                     1, 'comment', True, requests_per_second=2)
+        assert rates == [2] * 6  # 4 order lookups and 2 return requests
+        assert results['1'].instructions() == ('I12', {})
+        assert results['2'].instructions() == ('I21', {})
+        assert isinstance(results['3'], ValueError)
+        assert isinstance(results['missing'], requests.exceptions.HTTPError)
+        assert skus_and_qtys == {'B0': 1}
+
+    def test_fields(self, monkeypatch):
+        urls = []
+        def request(method, url, **kwargs):
+            urls.append(url)
+            return FakeResponse(200, body=[])
+        monkeypatch.setattr(api_client.requests, 'request', request)
+        ssapi = ssactivewear.SSActivewear('test', 'test')
+        ssapi.get_products(fields=['piecePrice', 'sku'])
+        ssapi.get_styles()
+        ssapi.get_order('111', fields=['lines'])
+        assert urls[0].endswith('/products/?fields=sku,piecePrice')
+        assert urls[1].endswith('/styles/')
+        assert urls[2].endswith('/orders/111?lines=true&fields=poNumber,invoiceNumber,orderType,orderStatus,lines')
 
 
 
@@ -165,6 +220,10 @@ class TestTicket:
         ticket = zendesk.Ticket({'subject': 'Where is my order?'})
         assert ticket.subject() == 'Where is my order?'
 
+    def test_creation_datetime(self):
+        ticket = zendesk.Ticket({'created_at': '2021-09-10T00:54:56Z'})
+        assert ticket.creation_datetime() == datetime.datetime(2021, 9, 10, 0, 54, 56)
+
     def test_custom_fields(self):
         ticket1 = zendesk.Ticket({'custom_fields': [{'id': '1', 'value': '2'}]})
         ticket2 = zendesk.Ticket({'custom_fields': [{'id': '3', 'value': '4'}, 
@@ -189,6 +248,163 @@ class TestZendesk:
         assert zen._auth == ('someone@example.com/token', 'token1')
         assert zen._url == 'https://subdomain.zendesk.com/api/v2/tickets'
 
+    def pages(self, monkeypatch, created_days: [[int]]):
+        """Serve pages of tickets created on the given days of September 2021."""
+        requested = []
+        def request(method, url, **kwargs):
+            requested.append(url)
+            page = int(url.split('page[after]=')[1]) if 'page[after]=' in url else 0
+            tickets = [{'id': f'{page}-{i}', 'created_at': f'2021-09-{day:02d}T12:00:00Z'} 
+                       for i, day in enumerate(created_days[page])]
+            has_more = page + 1 < len(created_days)
+            return FakeResponse(200, body={'tickets': tickets, 
+                                           'meta': {'has_more': has_more}, 
+                                           'links': {'next': f'{url.split("&page")[0]}&page[after]={page + 1}'}})
+        monkeypatch.setattr(api_client.requests, 'request', request)
+        return requested
+
+    def test_iter_tickets_exact_cutoff(self, monkeypatch):
+        requested = self.pages(monkeypatch, [[20, 19, 18], [18, 17, 16], [15, 14, 13], [12, 11, 10]])
+        zen = zendesk.Zendesk('subdomain', 'someone@example.com', 'token1')
+        tickets = zen.iter_tickets(since=datetime.date(2021, 9, 17), until=datetime.datetime(2021, 9, 20))
+        assert [ticket.id_num() for ticket in tickets] == ['0-1', '0-2', '1-0', '1-1']
+        assert len(requested) == 2
+
+    def test_iter_tickets_aware_datetimes(self, monkeypatch):
+        self.pages(monkeypatch, [[20, 19, 18, 17]])
+        zen = zendesk.Zendesk('subdomain', 'someone@example.com', 'token1')
+        eastern = datetime.timezone(datetime.timedelta(hours=-5))
+        tickets = zen.iter_tickets(since=datetime.datetime(2021, 9, 18, 8, tzinfo=eastern),
+                                   until=datetime.datetime(2021, 9, 20, tzinfo=datetime.timezone.utc))
+        assert [ticket.id_num() for ticket in tickets] == ['0-1']
+
+    def test_iter_tickets_last_page(self, monkeypatch):
+        self.pages(monkeypatch, [[20, 19], [18]])
+        zen = zendesk.Zendesk('subdomain', 'someone@example.com', 'token1')
+        assert len(list(zen.iter_tickets(since=datetime.date(2021, 1, 1)))) == 3
+
+    def cached_zendesk(self, monkeypatch, cache: zendesk.TicketCache) -> (zendesk.Zendesk, [str], dict, [str]):
+        """Serve tickets with the given updated_at values and report the ones 
+        changed since the last export.
+        """
+        requested = []
+        updated = {'1': 'a', '2': 'a', '3': 'a'}
+        changed = []
+        def request(method, url, **kwargs):
+            requested.append(url)
+            if '/incremental/' in url:
+                tickets = [{'id': int(i), 'updated_at': updated[i]} for i in changed]
+                changed.clear()
+                return FakeResponse(200, body={'tickets': tickets, 'after_cursor': 'c', 'end_of_stream': True})
+            if 'ids=' not in url:
+                ticket_id = url.split('/')[-1].split('?')[0]
+                if ticket_id not in updated:
+                    return FakeResponse(404)
+                return FakeResponse(200, body={'ticket': {'id': int(ticket_id), 'updated_at': updated[ticket_id]}})
+            ids = url.split('ids=')[1].split('&')[0].split(',')
+            return FakeResponse(200, body={'tickets': [{'id': int(i), 'updated_at': updated[i], 
+                                                        'requester_id': 10, 'group_id': 20} for i in ids], 
+                                           'users': [{'id': 10, 'name': 'Customer'}], 
+                                           'groups': [{'id': 20, 'name': 'Support'}]})
+        monkeypatch.setattr(api_client.requests, 'request', request)
+        zen = zendesk.Zendesk('subdomain', 'someone@example.com', 'token1', ticket_cache=cache)
+        return zen, requested, updated, changed
+
+    def test_get_tickets_with_cache(self, monkeypatch):
+        cache = zendesk.TicketCache(revalidate_after=60)
+        zen, requested, updated, changed = self.cached_zendesk(monkeypatch, cache)
+
+        bundle = zen.get_tickets(['1', '2'])
+        assert requested == ['https://subdomain.zendesk.com/api/v2/tickets/show_many.json'
+                             '?ids=1,2&include=users,groups,organizations']
+        ticket = bundle.ticket('2')
+        assert bundle.requester(ticket) == {'id': 10, 'name': 'Customer'}
+        assert bundle.group(ticket) == {'id': 20, 'name': 'Support'}
+        assert bundle.organization(ticket) is None
+
+        bundle = zen.get_tickets(['1', '2', '3'])
+        assert requested[1].startswith('https://subdomain.zendesk.com/api/v2/incremental/tickets/cursor.json?start_time=')
+        assert requested[2].endswith('?ids=3&include=users,groups,organizations')
+        assert [ticket.id_num() for ticket in bundle.tickets()] == [1, 2, 3]
+        assert len(bundle.data()['users']) == 1
+        assert zen.get_ticket('1').id_num() == 1
+        assert len(requested) == 3
+
+        updated['1'] = 'b'
+        cache.update_from([zendesk.Ticket({'id': 1, 'updated_at': 'b'}), 
+                           zendesk.Ticket({'id': 2, 'updated_at': 'a'})])
+        assert zen.get_ticket('1').updated_at() == 'b'
+        assert zen.get_ticket('2').updated_at() == 'a'
+        assert len(requested) == 4
+
+    def test_cache_revalidates_updated_tickets(self, monkeypatch):
+        cache = zendesk.TicketCache(revalidate_after=0)
+        zen, requested, updated, changed = self.cached_zendesk(monkeypatch, cache)
+        zen.get_tickets(['1', '2'])
+        updated['2'] = 'b'
+        changed.append('2')
+        assert [ticket.updated_at() for ticket in zen.get_tickets(['1', '2']).tickets()] == ['a', 'b']
+        assert '?start_time=' in requested[1]
+        assert requested[2].endswith('?ids=2&include=users,groups,organizations')
+        assert zen.get_ticket('2').updated_at() == 'b'
+        assert requested[3].endswith('/incremental/tickets/cursor.json?cursor=c')
+        assert len(requested) == 4
+
+    def test_cache_is_bypassed_without_export(self, monkeypatch):
+        cache = zendesk.TicketCache(revalidate_after=0)
+        zen, requested, updated, changed = self.cached_zendesk(monkeypatch, cache)
+        real_request = api_client.requests.request
+        def request(method, url, **kwargs):
+            if '/incremental/' in url:
+                requested.append(url)
+                return FakeResponse(403)
+            return real_request(method, url, **kwargs)
+        monkeypatch.setattr(api_client.requests, 'request', request)
+        assert zen.get_ticket('1').updated_at() == 'a'
+        updated['1'] = 'b'
+        assert zen.get_ticket('1').updated_at() == 'b'
+        assert [ticket.updated_at() for ticket in zen.get_tickets(['1']).tickets()] == ['b']
+        assert ['/incremental/' in url for url in requested] == [False, True, False, True, False]
+
+    def test_cached_get_ticket_keeps_404(self, monkeypatch):
+        zen, requested, updated, changed = self.cached_zendesk(monkeypatch, zendesk.TicketCache())
+        with pytest.raises(requests.exceptions.HTTPError):
+            zen.get_ticket('9')
+        assert zen.get_ticket('3').updated_at() == 'a'
+        assert zen.get_ticket('3').updated_at() == 'a'
+        assert requested[1].endswith('/tickets/3?include=users,groups,organizations')
+
+    def test_ticket_cache_max_age(self):
+        cache = zendesk.TicketCache(max_age=0)
+        cache.put({'id': 1, 'updated_at': 'a'}, [], [], [])
+        assert len(cache) == 1
+        assert cache.get(1) is None
+        cache = zendesk.TicketCache()
+        cache.put({'id': 1, 'updated_at': 'a'}, [], [], [])
+        cache.invalidate('1')
+        assert cache.get(1) is None
+
+    def test_tickets_created_between_today_and(self, monkeypatch):
+        self.pages(monkeypatch, [[20, 19], [18, 17], [16, 15]])
+        zen = zendesk.Zendesk('subdomain', 'someone@example.com', 'token1')
+        tickets = zen.tickets_created_between_today_and(9, 17, 2021)
+        assert [ticket.creation_datetime().day for ticket in tickets] == [20, 19, 18, 17]
+
+
+
+class TestChannelAdvisor:
+    def test_projection(self, monkeypatch):
+        urls = []
+        def request(method, url, **kwargs):
+            urls.append(url)
+            return FakeResponse(200, body={'ID': 5, 'value': [{'ID': 5}]})
+        monkeypatch.setattr(api_client.requests, 'request', request)
+        ca_api = channeladvisor.ChannelAdvisor('token')
+        ca_api.get_order('123456789', fields=['SiteOrderID'], expand=['Items'])
+        ca_api.get_order('5')
+        assert urls[0].endswith("?access_token=token&$select=ID&$filter=SiteOrderID eq '123456789'")
+        assert urls[1].endswith('(5)?access_token=token&$select=ID,SiteOrderID&$expand=Items')
+        assert urls[2].endswith('(5)?access_token=token&$expand=Items,Fulfillments')
 
 
 class TestChannelAdvisorOrder:
@@ -242,4 +458,602 @@ class TestChannelAdvisorOrder:
 
     def test_shipping_status(self):
         ca_order = channeladvisor.ChannelAdvisorOrder({'ShippingStatus': 'Shipped'})
-        assert ca_order.shipping_status() == 'Shipped'
\ No newline at end of file
+        assert ca_order.shipping_status() == 'Shipped'
+
+
+class FakeResponse:
+    def __init__(self, status_code: int, headers: dict = None, body=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.content = json.dumps(body).encode()
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(response=self)
+
+
+class TestCircuitBreaker:
+    def test_opens_after_threshold(self):
+        breaker = retry.CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        breaker.record_failure()
+        assert breaker.allow_request()
+        breaker.record_failure()
+        assert breaker.state() == 'open'
+        assert not breaker.allow_request()
+
+    def test_half_open_trial(self):
+        breaker = retry.CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        breaker.record_failure()
+        assert breaker.state() == 'half-open'
+        assert breaker.allow_request()
+        assert not breaker.allow_request()
+        breaker.record_success()
+        assert breaker.state() == 'closed'
+
+
+class TestRetryPolicy:
+    @pytest.fixture(autouse=True)
+    def no_sleep(self, monkeypatch):
+        self.delays = []
+        monkeypatch.setattr(retry.time, 'sleep', self.delays.append)
+
+    def sender(self, *outcomes):
+        calls = []
+        def send_once(method, url, **kwargs):
+            calls.append(method)
+            outcome = outcomes[len(calls) - 1]
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+        return send_once, calls
+
+    def test_retries_until_success(self):
+        policy = retry.RetryPolicy(max_retries=3)
+        send_once, calls = self.sender(FakeResponse(503), FakeResponse(502), FakeResponse(200))
+        assert policy.send(send_once, 'get', 'https://a.com/x').status_code == 200
+        assert calls == ['GET', 'GET', 'GET']
+        assert len(self.delays) == 2
+
+    def test_returns_last_response_when_out_of_retries(self):
+        policy = retry.RetryPolicy(max_retries=1)
+        send_once, calls = self.sender(FakeResponse(503), FakeResponse(503))
+        assert policy.send(send_once, 'GET', 'https://a.com/x').status_code == 503
+        assert len(calls) == 2
+
+    def test_does_not_retry_post(self):
+        policy = retry.RetryPolicy()
+        send_once, calls = self.sender(FakeResponse(503))
+        assert policy.send(send_once, 'POST', 'https://a.com/x').status_code == 503
+        with pytest.raises(requests.exceptions.ConnectionError):
+            policy.send(self.sender(requests.exceptions.ConnectionError())[0],
+                        'POST', 'https://a.com/x')
+        assert self.delays == []
+
+    def test_retries_connection_errors(self):
+        policy = retry.RetryPolicy()
+        send_once, calls = self.sender(requests.exceptions.ConnectionError(), FakeResponse(200))
+        assert policy.send(send_once, 'GET', 'https://a.com/x').status_code == 200
+
+    def test_honors_retry_after(self):
+        policy = retry.RetryPolicy(max_retry_after=10)
+        send_once, calls = self.sender(FakeResponse(429, {'Retry-After': '7'}), FakeResponse(200))
+        policy.send(send_once, 'GET', 'https://a.com/x')
+        assert self.delays == [7.0]
+
+        send_once, calls = self.sender(FakeResponse(429, {'Retry-After': '20'}))
+        assert policy.send(send_once, 'GET', 'https://a.com/x').status_code == 429
+
+    def test_backoff_is_bounded(self):
+        policy = retry.RetryPolicy(backoff_factor=1, max_backoff=5)
+        for attempt in range(10):
+            assert 0 <= policy.backoff(attempt) <= min(5, 2 ** attempt)
+
+    def test_circuit_fails_fast(self):
+        policy = retry.RetryPolicy(max_retries=0, failure_threshold=2)
+        send_once, calls = self.sender(FakeResponse(500), FakeResponse(500))
+        policy.send(send_once, 'GET', 'https://down.com/x')
+        policy.send(send_once, 'GET', 'https://down.com/y')
+        with pytest.raises(retry.CircuitOpenError):
+            policy.send(send_once, 'GET', 'https://down.com/z')
+        assert len(calls) == 2
+        assert policy.circuit_breaker('up.com').state() == 'closed'
+
+    def test_circuit_counts_requests_not_attempts(self):
+        policy = retry.RetryPolicy()
+        send_once, calls = self.sender(*[FakeResponse(503)] * 6)
+        assert policy.send(send_once, 'GET', 'https://down.com/x').status_code == 503
+        assert len(calls) == 6
+        assert policy.circuit_breaker('down.com').state() == 'closed'
+
+    def test_running_request_is_not_refused(self):
+        policy = retry.RetryPolicy(failure_threshold=1)
+        def send_once(method, url, **kwargs):
+            if not self.delays:
+                policy.circuit_breaker('down.com').record_failure()  # another request failed
+                return FakeResponse(503)
+            return FakeResponse(200)
+        assert policy.send(send_once, 'GET', 'https://down.com/x').status_code == 200
+        assert policy.circuit_breaker('down.com').state() == 'closed'
+
+    def test_failed_trial_does_not_lock_circuit(self):
+        policy = retry.RetryPolicy(max_retries=0, failure_threshold=1, reset_timeout=0)
+        policy.send(self.sender(FakeResponse(500))[0], 'GET', 'https://down.com/x')
+        for error in (requests.exceptions.InvalidURL(), requests.exceptions.ChunkedEncodingError(), 
+                      LookupError()):
+            with pytest.raises(type(error)):
+                policy.send(self.sender(error)[0], 'GET', 'https://down.com/x')
+            assert policy.circuit_breaker('down.com').state() == 'half-open'
+        assert policy.send(self.sender(FakeResponse(200))[0], 'GET', 'https://down.com/x').status_code == 200
+        assert policy.circuit_breaker('down.com').state() == 'closed'
+
+    def test_retryable_override(self):
+        policy = retry.RetryPolicy()
+        send_once, calls = self.sender(FakeResponse(503))
+        assert policy.send(send_once, 'PUT', 'https://a.com/x', retryable=False).status_code == 503
+        send_once, calls = self.sender(FakeResponse(503), FakeResponse(200))
+        assert policy.send(send_once, 'POST', 'https://a.com/x', retryable=True).status_code == 200
+        assert len(self.delays) == 1
+
+    def test_reply_is_sent_once(self, monkeypatch):
+        methods = []
+        def request(method, url, **kwargs):
+            methods.append(method)
+            return FakeResponse(503)
+        monkeypatch.setattr(api_client.requests, 'request', request)
+        zen_api = zendesk.Zendesk('test', 'test@example.com', 'test', retry_policy=retry.RetryPolicy())
+        with pytest.raises(requests.exceptions.HTTPError):
+            zen_api.reply_to('1', 'Hello')
+        assert methods == ['PUT']
+
+
+class TestTokenBucket:
+    def test_burst_then_wait(self):
+        bucket = rate_limit.TokenBucket(rate=10, capacity=2)
+        assert bucket.try_acquire() == 0
+        assert bucket.try_acquire() == 0
+        assert 0 < bucket.try_acquire() <= 0.1
+
+    def test_sqlite_bucket_is_shared(self, tmp_path):
+        path = str(tmp_path / 'limits.db')
+        bucket1 = rate_limit.SQLiteTokenBucket(path, 'api', rate=0.01, capacity=2)
+        bucket2 = rate_limit.SQLiteTokenBucket(path, 'api', rate=0.01, capacity=2)
+        other = rate_limit.SQLiteTokenBucket(path, 'other', rate=0.01, capacity=1)
+        assert bucket1.try_acquire() == 0
+        assert bucket2.try_acquire() == 0
+        assert bucket1.try_acquire() > 0
+        assert other.try_acquire() == 0
+
+
+class TestRateLimiter:
+    def test_acquire_uses_host_bucket(self):
+        limited = rate_limit.TokenBucket(rate=1, capacity=1)
+        limiter = rate_limit.RateLimiter({'api.ssactivewear.com': limited})
+        limiter.acquire('https://api.ssactivewear.com/v2/products/')
+        assert limited.try_acquire() > 0
+        limiter.acquire('https://example.zendesk.com/api/v2/tickets')
+
+    def test_shared(self, tmp_path):
+        limiter = rate_limit.RateLimiter.shared(str(tmp_path / 'limits.db'), {'a.com': (100, 1)})
+        limiter.acquire('https://a.com/x')
+        limiter.acquire('https://a.com/y')
+
+
+class TestInstrumentation:
+    def test_hooks_and_collector(self, monkeypatch):
+        responses = [FakeResponse(503), FakeResponse(200, body=[{'sku': 'B0'}, {'sku': 'B1'}])]
+        monkeypatch.setattr(api_client.requests, 'request', lambda method, url, **kwargs: responses.pop(0))
+        monkeypatch.setattr(retry.time, 'sleep', lambda seconds: None)
+        hooks = instrumentation.Instrumentation()
+        collector = instrumentation.MetricsCollector()
+        hooks.attach(collector)
+        seen = []
+        hooks.add_pre_request(seen.append)
+
+        ssapi = ssactivewear.SSActivewear('test', 'test', retry_policy=retry.RetryPolicy(), hooks=hooks)
+        assert list(ssapi.get_products()) == ['B0', 'B1']
+
+        assert [info.operation for info in seen] == ['SSActivewear.get_products'] * 2
+        assert seen[0].url == 'https://api.ssactivewear.com/v2/products/'
+        stats = collector.as_dict()['SSActivewear.get_products']
+        assert stats['requests'] == 2
+        assert stats['retries'] == 1
+        assert stats['statuses'] == {503: 1, 200: 1}
+        assert stats['response_bytes'] == len(b'null') + len(b'[{"sku": "B0"}, {"sku": "B1"}]')
+        assert stats['latency_seconds']['count'] == 2
+        assert stats['json_decode_seconds']['count'] == 1
+
+    def test_rate_limit_wait_is_not_timed(self, monkeypatch):
+        events = []
+        class Limiter:
+            def acquire(self, url):
+                events.append('acquire')
+        def request(method, url, **kwargs):
+            events.append('request')
+            return FakeResponse(200, body=[])
+        monkeypatch.setattr(api_client.requests, 'request', request)
+        hooks = instrumentation.Instrumentation()
+        hooks.add_pre_request(lambda info: events.append('pre_request'))
+        ssapi = ssactivewear.SSActivewear('test', 'test', rate_limiter=Limiter(), hooks=hooks)
+        ssapi.get_products()
+        assert events == ['acquire', 'pre_request', 'request']
+
+    def test_nested_operations_keep_outer_name(self):
+        class Client(api_client.APIClient):
+            @api_client.operation
+            def outer(self):
+                return self.inner()
+
+            @api_client.operation
+            def inner(self):
+                return self._operation()
+
+            @api_client.operation
+            def pages(self):
+                yield self.inner()
+                yield self._operation()
+
+        assert Client().outer() == 'Client.outer'
+        pages = Client().pages()
+        assert Client()._operation() == 'Client.request'
+        assert list(pages) == ['Client.pages', 'Client.pages']
+        assert Client().inner() == 'Client.inner'
+        assert Client()._operation() == 'Client.request'
+
+    def test_to_prometheus(self):
+        collector = instrumentation.MetricsCollector(buckets=(0.1, 1))
+        info = instrumentation.RequestInfo('Zendesk.reply_to', 'PUT', 'https://a.com/x?token=1', 0)
+        info.status_code, info.elapsed, info.response_bytes = 200, 0.5, 10
+        collector.record_request(info)
+        text = collector.to_prometheus()
+        assert 'cso_utils_requests_total{operation="Zendesk.reply_to",status="200"} 1' in text
+        assert 'cso_utils_request_duration_seconds_bucket{operation="Zendesk.reply_to",le="0.1"} 0' in text
+        assert 'cso_utils_request_duration_seconds_bucket{operation="Zendesk.reply_to",le="1"} 1' in text
+        assert 'cso_utils_request_duration_seconds_bucket{operation="Zendesk.reply_to",le="+Inf"} 1' in text
+        assert 'cso_utils_response_bytes_total{operation="Zendesk.reply_to"} 10' in text
+        assert 'token' not in info.url
+
+
+class TestCassette:
+    def real_response(self, status_code: int, body) -> requests.Response:
+        response = requests.Response()
+        response.status_code = status_code
+        response.reason = 'OK'
+        response.headers['Content-Type'] = 'application/json'
+        response._content = json.dumps(body).encode()
+        response.elapsed = datetime.timedelta(seconds=0.25)
+        return response
+
+    def test_record_then_replay(self, tmp_path, monkeypatch):
+        path = str(tmp_path / 'ca.jsonl.gz')
+        sent = []
+        def request(method, url, **kwargs):
+            sent.append(url)
+            return self.real_response(200, {'ID': len(sent), 'Items': []})
+        monkeypatch.setattr(api_client.requests, 'request', request)
+
+        with cassette.Cassette(path, 'record') as recorder:
+            ca = channeladvisor.ChannelAdvisor('secret', cassette=recorder)
+            assert ca.get_order('1').po_number() == '1'
+            assert ca.get_order('1').po_number() == '2'
+        with gzip.open(path) as f:
+            assert b'secret' not in f.read()
+
+        monkeypatch.setattr(api_client.requests, 'request', None)
+        player = cassette.Cassette(path, 'replay')
+        ca = channeladvisor.ChannelAdvisor('other token', cassette=player)
+        assert ca.get_order('1').po_number() == '1'
+        assert ca.get_order('1').po_number() == '2'
+        assert ca.get_order('1').po_number() == '2'
+        with pytest.raises(cassette.CassetteMissError):
+            ca.get_order('3')
+
+    def test_replay_matches_body_and_latency(self, tmp_path, monkeypatch):
+        path = str(tmp_path / 'zendesk.jsonl.gz')
+        monkeypatch.setattr(api_client.requests, 'request',
+                            lambda method, url, **kwargs: self.real_response(201, {'ticket': {'id': kwargs['json']['n']}}))
+        recorder = cassette.Cassette(path, 'record')
+        for n in (1, 2):
+            recorder.record('POST', 'https://a.com/x', api_client.requests.request('POST', 'https://a.com/x', json={'n': n}), json={'n': n})
+        recorder.close()
+
+        delays = []
+        monkeypatch.setattr(cassette.time, 'sleep', delays.append)
+        player = cassette.Cassette(path, 'replay', latency=0.1, recorded_latency=True)
+        assert player.play('POST', 'https://a.com/x', json={'n': 2}).json() == {'ticket': {'id': 2}}
+        assert player.play('post', 'https://a.com/x', json={'n': 1}).status_code == 201
+        assert delays == [0.35, 0.35]
+
+    def test_next_link_is_scrubbed(self, tmp_path, monkeypatch):
+        path = str(tmp_path / 'ca.jsonl.gz')
+        def request(method, url, **kwargs):
+            if 'skip=1' in url:
+                return self.real_response(200, {'value': [{'ID': 2}]})
+            return self.real_response(200, {'value': [{'ID': 1}], 
+                                            '@odata.nextLink': 'https://api.channeladvisor.com/v1/Orders?access_token=secret&$skip=1'})
+        monkeypatch.setattr(api_client.requests, 'request', request)
+        with cassette.Cassette(path, 'record') as recorder:
+            ca = channeladvisor.ChannelAdvisor('secret', cassette=recorder)
+            assert [order.po_number() for order in ca.iter_orders_shipped_on(9, 1, 2021)] == ['1', '2']
+        with gzip.open(path) as f:
+            assert b'secret' not in f.read()
+
+        monkeypatch.setattr(api_client.requests, 'request', None)
+        ca = channeladvisor.ChannelAdvisor('other token', cassette=cassette.Cassette(path, 'replay'))
+        assert [order.po_number() for order in ca.iter_orders_shipped_on(9, 1, 2021)] == ['1', '2']
+
+    def test_scrub_url(self):
+        assert (cassette.scrub_url("https://a.com/v1/Orders?access_token=abc&$filter=ID eq '1'") ==
+                "https://a.com/v1/Orders?$filter=ID eq '1'")
+
+
+class TestPriceMatrix:
+    def matrix(self):
+        products = {'B0': ssactivewear.Product({'sku': 'B0', 'piecePrice': 3.0, 'casePrice': 2.0, 
+                                                'salePrice': 0, 'caseQty': 10}),
+                    'B1': ssactivewear.Product({'sku': 'B1', 'piecePrice': 5.0, 'casePrice': 4.0, 
+                                                'salePrice': 1.5, 'caseQty': 12}),
+                    'B2': ssactivewear.Product({'sku': 'B2', 'piecePrice': 1.0})}
+        return pricing.PriceMatrix.from_products(products)
+
+    def test_line_totals(self):
+        matrix = self.matrix()
+        totals = matrix.line_totals(['B0', 'B0', 'B0', 'B1', 'B2'], [1, 10, 23, 2, 4])
+        assert totals.tolist() == [3.0, 20.0, 49.0, 3.0, 4.0]
+
+    def test_line_totals_with_indices(self):
+        matrix = self.matrix()
+        rows = matrix.indices(['B2', 'B0'])
+        assert rows.tolist() == [2, 0]
+        assert matrix.line_totals(rows, [2, 2]).tolist() == [2.0, 6.0]
+
+    def test_unknown_sku(self):
+        with pytest.raises(KeyError, match=r'B9'):
+            self.matrix().line_totals(['B0', 'B9'], [1, 1])
+
+    def test_quote(self):
+        quote = self.matrix().quote(['B0', 'B2', 'B0'], [10, 4, 1], ['po1', 'po2', 'po2'])
+        assert quote.line_totals().tolist() == [20.0, 4.0, 3.0]
+        assert quote.unit_prices().tolist() == [2.0, 1.0, 3.0]
+        assert quote.order_totals() == {'po1': 20.0, 'po2': 7.0}
+        assert quote.total() == 27.0
+
+    def test_quote_with_order_codes(self):
+        matrix = self.matrix()
+        codes, order_ids = matrix.order_codes(['po2', 'po1', 'po2'])
+        assert codes.tolist() == [0, 1, 0]
+        assert order_ids == ['po2', 'po1']
+        quote = matrix.quote(matrix.indices(['B0', 'B2', 'B0']), [10, 4, 1], codes)
+        assert quote.order_totals() == {0: 23.0, 1: 4.0}
+
+
+class TestReconciliation:
+    def ca_order(self, po_number: int, items: [(str, int)]) -> channeladvisor.ChannelAdvisorOrder:
+        return channeladvisor.ChannelAdvisorOrder({'ID': po_number, 
+                                                   'Items': [{'Sku': sku, 'Quantity': qty} for sku, qty in items]})
+
+    def ss_order(self, po_number: int, lines: [(str, int, int)]) -> ssactivewear.Order:
+        return ssactivewear.Order([{'poNumber': str(po_number), 'invoiceNumber': '1', 
+                                    'lines': [{'sku': sku, 'qtyOrdered': ordered, 'qtyShipped': shipped} 
+                                              for sku, ordered, shipped in lines]}])
+
+    def test_compare(self):
+        ca_order = self.ca_order(1, [('B0', 2), ('B1', 1), ('B2', 3), ('B3', 1)])
+        ss_order = self.ss_order(1, [('B0', 2, 2), ('B1', 2, 2), ('B2', 3, 1), ('B4', 1, 1)])
+        found = [(d.kind(), d.sku()) for d in reconciliation.compare(ca_order, ss_order)]
+        assert found == [('qty_mismatch', 'B1'), ('unshipped', 'B2'), 
+                         ('missing_sku', 'B3'), ('unexpected_sku', 'B4')]
+
+        assert [d.data() for d in reconciliation.compare(ca_order, None)] == [{'kind': 'missing_po', 'po_number': '1'}]
+        assert reconciliation.compare(ca_order, ValueError('x'))[0].error() == "ValueError('x')"
+
+    def test_reconcile(self):
+        orders = {'1': self.ss_order(1, [('B0', 1, 1)]), 
+                  '2': self.ss_order(2, [('B0', 1, 0)]), 
+                  '3': ssactivewear.Order([])}
+        class FakeSSActivewear:
+            def get_order(self, po_number):
+                if po_number == '4':
+                    response = requests.Response()
+                    response.status_code = 404
+                    raise requests.exceptions.HTTPError(response=response)
+                return orders[po_number]
+
+        ca_orders = (self.ca_order(po_number, [('B0', 1)]) for po_number in range(1, 5))
+        found = [(d.po_number(), d.kind()) 
+                 for d in reconciliation.reconcile(ca_orders, FakeSSActivewear(), window=2)]
+        assert found == [('2', 'unshipped'), ('3', 'missing_po'), ('4', 'missing_po')]
+
+
+class TestLazyImports:
+    def loaded_after(self, statement: str) -> [str]:
+        script = (f'import sys; {statement}; '
+                  'print(sorted(name for name in ("bs4", "github", "pymysql", "numpy", "cso_utils.database") '
+                  'if name in sys.modules))')
+        return subprocess.run([sys.executable, '-c', script], check=True, 
+                              capture_output=True, text=True).stdout.strip()
+
+    def test_clients_do_not_import_heavy_packages(self):
+        assert self.loaded_after('import cso_utils') == '[]'
+        assert self.loaded_after('from cso_utils import zendesk') == '[]'
+        assert self.loaded_after('from cso_utils import ssactivewear, channeladvisor, github_api') == '[]'
+
+    def test_attribute_access_imports_submodule(self):
+        assert self.loaded_after('import cso_utils; cso_utils.database') == "['cso_utils.database', 'pymysql']"
+        import cso_utils
+        assert cso_utils.zendesk is zendesk
+        with pytest.raises(AttributeError):
+            cso_utils.missing
+
+    def test_pricing_without_numpy(self):
+        script = ('import sys; sys.modules["numpy"] = None\n'
+                  'try:\n    from cso_utils import pricing\n'
+                  'except ImportError as e:\n    print(e)')
+        output = subprocess.run([sys.executable, '-c', script], check=True,
+                                capture_output=True, text=True).stdout
+        assert 'requires numpy' in output
+
+
+class TestTrackingWatcher:
+    class FakeSSActivewear:
+        def __init__(self):
+            self.messages = {}
+            self.delivery_dates = {}
+            self.requested = []
+
+        def track_using_tracking(self, nums):
+            self.requested.append(list(nums))
+            return ssactivewear.Tracking([{'trackingNumber': num, 
+                                           'actualDeliveryDate': self.delivery_dates.get(num), 
+                                           'latestCheckpoint': {'checkpointDate': '6/28/2021', 
+                                                                'checkpointTime': '7:00 AM', 
+                                                                'checkpointStatusMessage': self.messages[num]}} 
+                                          for num in nums if num in self.messages])
+
+    def test_poll_yields_changes_only(self, tmp_path):
+        ss_api = self.FakeSSActivewear()
+        watcher = tracking_watch.TrackingWatcher(ss_api, str(tmp_path / 'tracking.db'), batch_size=2, 
+                                                 active_interval=10, max_interval=100)
+        ss_api.messages = {'1': 'Label Created', '2': 'In Transit', '3': 'In Transit'}
+        watcher.watch(['1', '2', '3'], now=0)
+        assert sorted(watcher.poll(now=0)) == [('1', '6/28/2021 at 7:00 AM - Label Created'), 
+                                               ('2', '6/28/2021 at 7:00 AM - In Transit'), 
+                                               ('3', '6/28/2021 at 7:00 AM - In Transit')]
+        assert ss_api.requested == [['1', '2'], ['3']]
+
+        assert list(watcher.poll(now=5)) == []
+        ss_api.messages['1'] = 'Delivered'
+        assert list(watcher.poll(now=10)) == [('1', '6/28/2021 at 7:00 AM - Delivered')]
+        assert watcher.status('2') == '6/28/2021 at 7:00 AM - In Transit'
+
+        # unchanged numbers wait twice as long, delivered ones are not polled again
+        assert watcher.due(now=29) == []
+        assert watcher.due(now=30) == ['2', '3']
+        watcher.unwatch(['3'])
+        assert watcher.due(now=1000) == ['2']
+
+    def test_stale_packages_wait_longest(self, tmp_path):
+        ss_api = self.FakeSSActivewear()
+        watcher = tracking_watch.TrackingWatcher(ss_api, str(tmp_path / 'tracking.db'), 
+                                                 active_interval=10, max_interval=100, stale_after=15)
+        ss_api.messages = {'1': 'In Transit'}
+        watcher.watch(['1', '2'], now=0)
+        list(watcher.poll(now=0))
+        list(watcher.poll(now=20))
+        assert watcher.due(now=119) == []
+        assert watcher.due(now=120) == ['1', '2']
+
+    def test_only_delivered_packages_stop(self, tmp_path):
+        ss_api = self.FakeSSActivewear()
+        watcher = tracking_watch.TrackingWatcher(ss_api, str(tmp_path / 'tracking.db'), 
+                                                 active_interval=10, max_interval=100)
+        ss_api.messages = {'1': 'Not Delivered', '2': 'Undelivered - address issue', 
+                           '3': 'DELIVERED', '4': 'Left at front door'}
+        ss_api.delivery_dates = {'4': '2021-06-28'}
+        watcher.watch(['1', '2', '3', '4'], now=0)
+        assert len(list(watcher.poll(now=0))) == 4
+        assert watcher.due(now=1000) == ['1', '2']
+
+
+class TestCatalogSnapshot:
+    def test_lookups(self, tmp_path):
+        path = str(tmp_path / 'catalog.snap')
+        products = {f'B{i}': ssactivewear.Product({'sku': f'B{i}', 'piecePrice': i}) for i in range(1000)}
+        styles = [ssactivewear.Style({'styleID': 1, 'title': 'Tee'}), 
+                  ssactivewear.Style({'styleID': 22, 'title': 'Hoodie'})]
+        catalog_snapshot.write_snapshot(path, products, styles)
+        with catalog_snapshot.CatalogSnapshot(path) as snapshot:
+            assert len(snapshot) == 1000
+            product = snapshot.get_product('B517')
+            assert isinstance(product, ssactivewear.Product)
+            assert product.piece_price() == 517
+            assert all(snapshot.get_product(sku).data() == product.data() 
+                       for sku, product in products.items())
+            assert snapshot.get_style(22).title() == 'Hoodie'
+            assert sorted(style.title() for style in snapshot.styles()) == ['Hoodie', 'Tee']
+            assert sum(1 for _ in snapshot.products()) == 1000
+            with pytest.raises(KeyError):
+                snapshot.get_product('missing')
+            with pytest.raises(KeyError):
+                snapshot.get_style(3)
+
+    def test_reload_if_changed(self, tmp_path):
+        path = str(tmp_path / 'catalog.snap')
+        catalog_snapshot.write_snapshot(path, [ssactivewear.Product({'sku': 'B0', 'piecePrice': 1})])
+        snapshot = catalog_snapshot.CatalogSnapshot(path)
+        old = snapshot.get_product('B0')
+        assert not snapshot.reload_if_changed()
+
+        catalog_snapshot.write_snapshot(path, [ssactivewear.Product({'sku': 'B0', 'piecePrice': 2}), 
+                                               ssactivewear.Product({'sku': 'B1', 'piecePrice': 3})])
+        assert [p.name for p in tmp_path.iterdir()] == ['catalog.snap']
+        assert snapshot.reload_if_changed()
+        assert snapshot.get_product('B0').piece_price() == 2
+        assert snapshot.get_product('B1').piece_price() == 3
+        assert old.piece_price() == 1
+        snapshot.close()
+
+    def test_not_a_snapshot(self, tmp_path):
+        path = tmp_path / 'catalog.snap'
+        path.write_bytes(b'x' * 100)
+        with pytest.raises(ValueError, match='not a catalog snapshot'):
+            catalog_snapshot.CatalogSnapshot(str(path))
+        path.write_bytes(b'x')
+        with pytest.raises(ValueError, match='not a catalog snapshot'):
+            catalog_snapshot.CatalogSnapshot(str(path))
+
+
+class TestColumnar:
+    ca_orders = [channeladvisor.ChannelAdvisorOrder({'ID': 1, 'SiteName': 'amazon', 
+                                                     'Items': [{'Sku': 'B0', 'Title': 'Tee', 'Quantity': 2, 
+                                                                'UnitPrice': 5.5, 'UnitEstimatedShippingCost': 1.0}, 
+                                                               {'Sku': 'B1', 'Title': 'Hoodie, red', 'Quantity': 1, 
+                                                                'UnitPrice': 20.0, 'UnitEstimatedShippingCost': 2.0}]}), 
+                 channeladvisor.ChannelAdvisorOrder({'ID': 2, 'SiteName': 'ebay', 
+                                                     'Items': [{'Sku': 'B2', 'Title': 'Cap', 'Quantity': 3, 
+                                                                'UnitPrice': 7.0, 'UnitEstimatedShippingCost': 0.5}]})]
+
+    def test_columns_match_lines(self):
+        columns = columnar.to_columns(columnar.CA_ORDER_LINES, self.ca_orders)
+        lines = [line for order in self.ca_orders for line in order.lines()]
+        for name in ('sku', 'title', 'qty', 'unit_price', 'unit_estimated_shipping_cost'):
+            assert list(columns[name]) == [line[name] for line in lines]
+        assert columns['po_number'] == ['1', '1', '2']
+
+        ss_orders = [ssactivewear.Order([{'poNumber': '1', 'invoiceNumber': '10', 
+                                          'lines': [{'sku': 'B0', 'qtyOrdered': 2, 'qtyShipped': 2}]}, 
+                                         {'poNumber': '1', 'invoiceNumber': '11', 
+                                          'lines': [{'sku': 'B1', 'qtyOrdered': 1}]}])]
+        columns = columnar.to_columns(columnar.SS_ORDER_LINES, ss_orders)
+        for name in ('invoice', 'sku', 'qty_ordered', 'qty_shipped'):
+            assert list(columns[name]) == [line[name] for line in ss_orders[0].lines()]
+
+        tickets = [zendesk.Ticket({'id': 5, 'subject': 'Hi', 'status': 'open', 'created_at': '2021-06-28T07:00:00Z', 
+                                   'group_id': 3, 'tags': ['a', 'b']})]
+        columns = columnar.to_columns(columnar.TICKETS, tickets)
+        assert list(columns['id']) == [5]
+        assert columns['group_id'] == [3]
+        assert columns['assignee_id'] == [None]
+        assert columns['tags'] == ['a b']
+
+    def test_iter_columns_consumes_lazily(self):
+        consumed = []
+        def orders():
+            for order in self.ca_orders * 3:
+                consumed.append(order)
+                yield order
+        chunks = columnar.iter_columns(columnar.CA_ORDER_LINES, orders(), chunk_size=3)
+        assert list(next(chunks)['sku']) == ['B0', 'B1', 'B2']
+        assert len(consumed) == 2
+        assert [len(chunk['sku']) for chunk in chunks] == [3, 3]
+
+    def test_write_csv(self, tmp_path):
+        path = str(tmp_path / 'lines.csv')
+        assert columnar.write_csv(path, columnar.CA_ORDER_LINES, iter(self.ca_orders), chunk_size=1) == 3
+        with open(path) as f:
+            assert f.read().splitlines() == ['po_number,site_name,sku,title,qty,unit_price,unit_estimated_shipping_cost', 
+                                             '1,amazon,B0,Tee,2,5.5,1.0', 
+                                             '1,amazon,B1,"Hoodie, red",1,20.0,2.0', 
+                                             '2,ebay,B2,Cap,3,7.0,0.5']